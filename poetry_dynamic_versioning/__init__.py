@@ -1,37 +1,77 @@
-__all__ = []  # type: ignore
+__all__ = [
+    "Session",
+    "VersionResult",
+    "get_version",
+]
 
+import atexit
 import copy
 import datetime as dt
+import functools
+import json
 import os
 import re
 import shlex
 import subprocess
 import sys
 import textwrap
+import threading
+import time
+from contextlib import contextmanager
 from enum import Enum
 from importlib import import_module
 from pathlib import Path
-from typing import Mapping, MutableMapping, Optional, Sequence, Tuple, Union
-
-import jinja2
-import tomlkit
-import tomlkit.items
-from dunamai import (
-    bump_version,
-    check_version,
-    Concern,
-    Pattern,
-    serialize_pep440,
-    serialize_pvp,
-    serialize_semver,
-    Style,
-    Vcs,
-    Version,
+from typing import (
+    Any,
+    BinaryIO,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    TYPE_CHECKING,
 )
 
+# Dunamai, Jinja, and Tomlkit are imported where they're needed,
+# since the plugin is loaded for every Poetry command,
+# including ones where we never compute a version.
+if TYPE_CHECKING:
+    from concurrent.futures import Future  # noqa: F401
+
+    import jinja2
+    from dunamai import Pattern, Vcs, Version
+
 _BYPASS_ENV = "POETRY_DYNAMIC_VERSIONING_BYPASS"
 _OVERRIDE_ENV = "POETRY_DYNAMIC_VERSIONING_OVERRIDE"
+_MANIFEST_ENV = "POETRY_DYNAMIC_VERSIONING_MANIFEST"
 _DEBUG_ENV = "POETRY_DYNAMIC_VERSIONING_DEBUG"
+_CACHE_DIR_ENV = "POETRY_DYNAMIC_VERSIONING_CACHE_DIR"
+_SERVER_ENV = "POETRY_DYNAMIC_VERSIONING_SERVER"
+_SHARE_ENV = "POETRY_DYNAMIC_VERSIONING_SHARE"
+
+# We only read from the repository, so we don't want Git to take the index lock
+# (which would make parallel builds in one checkout contend),
+# and we want its output to be the same regardless of the user's language.
+_VCS_ENV_OVERRIDES = {"GIT_OPTIONAL_LOCKS": "0", "LC_ALL": "C"}
+_VCS_ENV_EXCLUDED = ("GIT_TRACE", "GIT_PAGER", "GIT_EXTERNAL_DIFF", "GIT_DIFF_OPTS")
+_SHALLOW_DEEPEN_STEP = 16
+# Files or folders that mark the root of each kind of repository, in the order that Dunamai checks them.
+_VCS_MARKERS = [
+    (".git", "git"),
+    (".hg", "mercurial"),
+    ("_darcs", "darcs"),
+    (".svn", "subversion"),
+    (".bzr", "bazaar"),
+    (".fslckout", "fossil"),
+    ("_FOSSIL_", "fossil"),
+    (".pijul", "pijul"),
+]
+
+_WORKSPACE_CONFIG_FILE = "poetry-dynamic-versioning.toml"
+_RESOLUTION_FILE = "poetry-dynamic-versioning.json"
+_APPLIED_FILE = ".poetry-dynamic-versioning.json"
 
 if sys.version_info >= (3, 8):
     from typing import TypedDict
@@ -59,6 +99,7 @@ if sys.version_info >= (3, 8):
             "files": Sequence[str],
             "patterns": Sequence[Union[str, _SubstitutionPattern]],
             "folders": Sequence[_SubstitutionFolder],
+            "target": str,
         },
     )
 
@@ -68,6 +109,7 @@ if sys.version_info >= (3, 8):
             "persistent-substitution": Optional[bool],
             "initial-content": Optional[str],
             "initial-content-jinja": Optional[str],
+            "version-module": Optional[Union[bool, str]],
         },
     )
 
@@ -95,6 +137,32 @@ if sys.version_info >= (3, 8):
         },
     )
 
+    _Shallow = TypedDict(
+        "_Shallow",
+        {
+            "enable": bool,
+            "strategy": str,
+            "filter": Optional[str],
+        },
+        total=False,
+    )
+
+    _Format = TypedDict(
+        "_Format",
+        {
+            "format": Optional[str],
+            "format-jinja": Optional[str],
+            "style": Optional[str],
+            "metadata": Optional[bool],
+            "dirty": bool,
+            "bump": Union[bool, _Bump],
+            "tagged-metadata": bool,
+            "commit-prefix": Optional[str],
+            "escape-with": Optional[str],
+        },
+        total=False,
+    )
+
     _Config = TypedDict(
         "_Config",
         {
@@ -112,18 +180,22 @@ if sys.version_info >= (3, 8):
             "format": Optional[str],
             "format-jinja": Optional[str],
             "format-jinja-imports": Sequence[_JinjaImport],
+            "formats": Mapping[str, _Format],
             "bump": Union[bool, _Bump],
             "tagged-metadata": bool,
             "full-commit": bool,
             "tag-branch": Optional[str],
             "tag-dir": str,
             "strict": bool,
-            "fix-shallow-repository": bool,
+            "fix-shallow-repository": Union[bool, _Shallow],
             "ignore-untracked": bool,
             "commit-length": Optional[int],
             "commit-prefix": Optional[str],
             "escape-with": Optional[str],
             "from-file": _FromFile,
+            "inherit": bool,
+            "max-tag-search-depth": Optional[int],
+            "fallback-base": str,
         },
     )
 else:
@@ -134,6 +206,8 @@ else:
     _JinjaImport = Mapping
     _FromFile = Mapping
     _Bump = Mapping
+    _Shallow = Mapping
+    _Format = Mapping
     _Config = Mapping
 
 
@@ -142,6 +216,11 @@ class _Mode(Enum):
     Pep621 = "pep621"
 
 
+class _Target(Enum):
+    Source = "source"
+    Artifacts = "artifacts"
+
+
 class _ProjectState:
     def __init__(
         self,
@@ -149,8 +228,10 @@ class _ProjectState:
         original_version: Optional[str],
         version: str,
         mode: _Mode,
-        dynamic_array: Optional[tomlkit.items.Array],
+        dynamic_array: Optional[Sequence[str]],
         substitutions: Optional[MutableMapping[Path, str]] = None,
+        io: bool = True,
+        instance: Optional["Version"] = None,
     ) -> None:
         self.path = path
         self.original_version = original_version
@@ -158,16 +239,52 @@ class _ProjectState:
         self.mode = mode
         self.dynamic_array = dynamic_array
         self.substitutions = {} if substitutions is None else substitutions  # type: MutableMapping[Path, str]
+        self.io = io
+        self.instance = instance
+        # Index of the substitution folder config that applied to each substituted file.
+        self.substitution_folders = {}  # type: MutableMapping[Path, int]
+        # Whether other processes may be relying on the applied version too.
+        self.shared = False
+        # Whether we removed `inherit = true` while the plugin was disabled.
+        self.inherit = False
+
+
+class _Outcome:
+    def __init__(self, fingerprint: Tuple[int, int], name: Optional[str], enabled: bool) -> None:
+        self.fingerprint = fingerprint
+        # This is None when the file isn't for a Poetry project that we can handle.
+        self.name = name
+        self.enabled = enabled
 
 
 class _State:
-    def __init__(self) -> None:
+    """
+    Everything that we track while versioning projects.
+    The plugin and backend use the shared `_state`,
+    but a separate instance can be passed around to version other projects independently.
+    """
+
+    def __init__(self, share_results: bool = False) -> None:
+        # Guards the collections below when several threads share one instance.
+        self.lock = threading.RLock()
+        # Coordinate with other processes that apply the version to the same project.
+        self.share_results = share_results
         self.patched_core_poetry_create = False
         self.cli_mode = False
         self.projects = {}  # type: MutableMapping[str, _ProjectState]
+        # Results from an earlier process, keyed by the resolved pyproject.toml path.
+        self.resolutions = {}  # type: MutableMapping[str, Mapping]
+        # What we last decided for each resolved pyproject.toml path in this process.
+        self.outcomes = {}  # type: MutableMapping[str, _Outcome]
+        # Versions being resolved in the background, keyed by the resolved pyproject.toml path.
+        self.prefetched = {}  # type: MutableMapping[str, Tuple[Tuple[int, int], Future]]
 
 
-_state = _State()
+_state = _State(share_results=os.environ.get(_SHARE_ENV) == "1")
+
+
+def _get_session(session: Optional[_State]) -> _State:
+    return _state if session is None else session
 
 
 class _SubPattern:
@@ -225,6 +342,20 @@ class _BumpConfig:
             return _BumpConfig(config["enable"], config["index"])
 
 
+class _ShallowConfig:
+    def __init__(self, enable: bool, strategy: str, filter: Optional[str]):
+        self.enable = enable
+        self.strategy = strategy
+        self.filter = filter
+
+    @staticmethod
+    def from_config(config: Union[bool, _Shallow]) -> "_ShallowConfig":
+        if isinstance(config, bool):
+            return _ShallowConfig(config, "deepen", None)
+        else:
+            return _ShallowConfig(config.get("enable", True), config.get("strategy", "deepen"), config.get("filter"))
+
+
 def _default_config() -> Mapping:
     return {
         "tool": {
@@ -246,6 +377,7 @@ def _default_config() -> Mapping:
                         },
                     ],
                     "folders": [],
+                    "target": "source",
                 },
                 "files": {},
                 "style": None,
@@ -253,6 +385,7 @@ def _default_config() -> Mapping:
                 "format": None,
                 "format-jinja": None,
                 "format-jinja-imports": [],
+                "formats": {},
                 "bump": False,
                 "tagged-metadata": False,
                 "full-commit": False,
@@ -268,6 +401,9 @@ def _default_config() -> Mapping:
                     "source": None,
                     "pattern": None,
                 },
+                "inherit": False,
+                "max-tag-search-depth": None,
+                "fallback-base": "0.0.0",
             }
         }
     }
@@ -322,21 +458,34 @@ def _get_pyproject_path_from_poetry(pyproject) -> Path:
         raise RuntimeError("Unable to determine pyproject.toml path from Poetry instance")
 
 
-def _get_config(local: Mapping) -> _Config:
+def _get_config(local: Mapping, overrides: Optional[Mapping] = None, pyproject_path: Optional[Path] = None) -> _Config:
     def initialize(data, key):
         if isinstance(data, dict) and key not in data:
             data[key] = None
 
-    if isinstance(local, tomlkit.TOMLDocument):
+    # A Tomlkit document can only exist if Tomlkit was already imported.
+    tomlkit = sys.modules.get("tomlkit")
+    if tomlkit is not None and isinstance(local, tomlkit.TOMLDocument):
         local = local.unwrap()
 
-    merged = _deep_merge_dicts(_default_config(), local)["tool"]["poetry-dynamic-versioning"]  # type: _Config
+    if overrides is not None:
+        local = _deep_merge_dicts(local, {"tool": {"poetry-dynamic-versioning": overrides}})
+
+    base = _default_config()
+    table = local.get("tool", {}).get("poetry-dynamic-versioning", {})
+    if pyproject_path is not None and table.get("inherit"):
+        # A disabled project doesn't need the parent config, which might not be available,
+        # such as when it's been unpacked from a source distribution.
+        base = _get_inherited_config(pyproject_path, required=table.get("enable") is not False)
+
+    merged = _deep_merge_dicts(base, local)["tool"]["poetry-dynamic-versioning"]  # type: _Config
 
     # Add default values so we don't have to worry about missing keys
     for x in merged["files"].values():
         initialize(x, "initial-content")
         initialize(x, "initial-content-jinja")
         initialize(x, "persistent-substitution")
+        initialize(x, "version-module")
     for x in merged["format-jinja-imports"]:
         initialize(x, "item")
     for x in merged["substitution"]["folders"]:
@@ -348,17 +497,94 @@ def _get_config(local: Mapping) -> _Config:
     return merged
 
 
+@functools.lru_cache(maxsize=32)
+def _load_config_file(path: Path, fingerprint: Tuple[int, int]) -> Mapping:
+    return _load_toml(path.read_bytes().decode("utf-8"))
+
+
+@functools.lru_cache(maxsize=32)
+def _merge_inherited_configs(chain: Tuple[Tuple[Path, Tuple[int, int]], ...]) -> Mapping:
+    merged = _default_config()
+    for path, fingerprint in chain:
+        merged = _deep_merge_dicts(merged, _load_config_file(path, fingerprint))
+    return merged
+
+
+def _get_inherited_config(pyproject_path: Path, required: bool = True) -> Mapping:
+    """
+    Get the config that a project with `inherit = true` builds on:
+    the nearest workspace file or pyproject.toml above it with our table,
+    merged with whatever that file inherits in turn.
+    Each file is only parsed once per process, and the merged result is shared by all of the projects,
+    unless one of the files changes.
+    """
+    chain = []  # type: list
+    current = pyproject_path.resolve()
+    while True:
+        parent = _find_higher_file(_WORKSPACE_CONFIG_FILE, "pyproject.toml", start=current.parent.parent)
+        if parent is None:
+            if not chain and required:
+                raise RuntimeError("Unable to find a config for '{}' to inherit".format(pyproject_path))
+            break
+
+        current = parent
+        fingerprint = _get_file_fingerprint(parent)
+        table = _load_config_file(parent, fingerprint).get("tool", {}).get("poetry-dynamic-versioning")
+        if table is None:
+            # For example, a pyproject.toml for some other tool at the top of the repository.
+            continue
+
+        chain.append((parent, fingerprint))
+        if not table.get("inherit"):
+            break
+
+    # The outermost file goes first, so that closer files take precedence.
+    return _merge_inherited_configs(tuple(reversed(chain)))
+
+
+def _load_toml(content: str) -> Mapping:
+    """
+    Parse TOML for reading only. Use `tomlkit` instead if the document will be written back.
+    """
+    if "poetry-dynamic-versioning" not in content:
+        # Without our table, there's nothing we need from the document.
+        return {}
+
+    try:
+        import tomllib  # type: ignore
+    except ImportError:
+        import tomlkit
+
+        return tomlkit.parse(content).unwrap()
+    else:
+        return tomllib.loads(content)
+
+
+def _get_file_fingerprint(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _get_local_config_from_path(start: Optional[Path] = None) -> Optional[Mapping]:
+    pyproject_path = _get_pyproject_path(start)
+    if pyproject_path is None:
+        return None
+    return _load_toml(pyproject_path.read_bytes().decode("utf-8"))
+
+
 def _get_config_from_path(start: Optional[Path] = None) -> Mapping:
     pyproject_path = _get_pyproject_path(start)
     if pyproject_path is None:
         return _default_config()["tool"]["poetry-dynamic-versioning"]
-    pyproject = tomlkit.parse(pyproject_path.read_bytes().decode("utf-8"))
-    result = _get_config(pyproject)
+    local = _load_toml(pyproject_path.read_bytes().decode("utf-8"))
+    result = _get_config(local, pyproject_path=pyproject_path)
     return result
 
 
 def _validate_config(config: Optional[Mapping] = None) -> Sequence[str]:
     if config is None:
+        import tomlkit
+
         pyproject_path = _get_pyproject_path()
         if pyproject_path is None:
             raise RuntimeError("Unable to find pyproject.toml")
@@ -399,7 +625,9 @@ def _format_timestamp(value: Optional[dt.datetime]) -> Optional[str]:
     return value.strftime("%Y%m%d%H%M%S")
 
 
-def _render_jinja(version: Version, template: str, config: _Config, extra: Optional[Mapping] = None) -> str:
+def _render_jinja(version: "Version", template: str, config: _Config, extra: Optional[Mapping] = None) -> str:
+    from dunamai import bump_version, serialize_pep440, serialize_pvp, serialize_semver
+
     if extra is None:
         extra = {}
 
@@ -445,15 +673,30 @@ def _render_jinja(version: Version, template: str, config: _Config, extra: Optio
                 custom_context[entry["item"]] = getattr(module, entry["item"])
             else:
                 custom_context[entry["module"]] = module
-    serialized = jinja2.Template(template).render(**default_context, **custom_context)
+    serialized = _compile_jinja(template).render(**default_context, **custom_context)
     return serialized
 
 
-def _run_cmd(command: str, codes: Sequence[int] = (0,)) -> Tuple[int, str]:
+@functools.lru_cache(maxsize=16)
+def _compile_jinja(template: str) -> "jinja2.Template":
+    import jinja2
+
+    return jinja2.Template(template)
+
+
+def _get_vcs_env(base: Optional[Mapping[str, str]] = None) -> Mapping[str, str]:
+    env = {k: v for k, v in (os.environ if base is None else base).items() if not k.startswith(_VCS_ENV_EXCLUDED)}
+    env.update(_VCS_ENV_OVERRIDES)
+    return env
+
+
+def _run_cmd(command: str, codes: Sequence[int] = (0,), path: Optional[Path] = None) -> Tuple[int, str]:
     result = subprocess.run(
         shlex.split(command),
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
+        cwd=str(path) if path is not None else None,
+        env=_get_vcs_env(),
     )
     output = result.stdout.decode().strip()
     if codes and result.returncode not in codes:
@@ -467,13 +710,16 @@ def _get_override_version(name: Optional[str], env: Optional[Mapping] = None) ->
     if name is not None:
         raw_overrides = env.get(_OVERRIDE_ENV)
         if raw_overrides is not None:
-            pairs = raw_overrides.split(",")
-            for pair in pairs:
-                if "=" not in pair:
-                    continue
-                k, v = pair.split("=", 1)
-                if k.strip() == name:
-                    return v.strip()
+            override = _parse_overrides(raw_overrides).get(name)
+            if override is not None:
+                return override
+
+        manifest = env.get(_MANIFEST_ENV)
+        if manifest:
+            path = Path(manifest).resolve()
+            override = _read_manifest(path, _get_file_fingerprint(path)).get(name)
+            if override is not None:
+                return override
 
     bypass = env.get(_BYPASS_ENV)
     if bypass is not None:
@@ -482,14 +728,63 @@ def _get_override_version(name: Optional[str], env: Optional[Mapping] = None) ->
     return None
 
 
-def _get_version_from_file(config: _Config) -> Optional[str]:
+@functools.lru_cache(maxsize=16)
+def _parse_overrides(raw: str) -> Mapping[str, str]:
+    overrides = {}  # type: MutableMapping[str, str]
+    for pair in raw.split(","):
+        if "=" not in pair:
+            continue
+        k, v = pair.split("=", 1)
+        # The first entry for a package takes priority.
+        overrides.setdefault(k.strip(), v.strip())
+    return overrides
+
+
+@functools.lru_cache(maxsize=16)
+def _read_manifest(path: Path, fingerprint: Tuple[int, int]) -> Mapping[str, str]:
+    """
+    Read the versions from a manifest created by `poetry-dynamic-versioning export`.
+    The file's fingerprint is part of the cache key so that changes are picked up.
+    """
+    data = json.loads(path.read_bytes().decode("utf-8"))
+    versions = data.get("versions") if isinstance(data, dict) else None
+    if not isinstance(versions, dict):
+        raise ValueError("Manifest '{}' does not contain a 'versions' table".format(path))
+    return versions
+
+
+def _get_workspace_projects(pyproject_path: Path) -> Sequence[Path]:
+    """
+    Find a project and its path dependencies, recursively,
+    including only the dependencies that have the plugin enabled.
+    """
+    import tomlkit
+
+    projects = [pyproject_path.resolve()]
+    pending = list(projects)
+    while pending:
+        current = pending.pop(0)
+        # The root project might not have our table, so we can't use `_load_toml` here.
+        local = tomlkit.parse(current.read_bytes().decode("utf-8")).unwrap()
+        for dependency in _get_path_dependencies(local):
+            path = (current.parent / dependency / "pyproject.toml").resolve()
+            if path in projects or not path.is_file():
+                continue
+            dependency_local = _load_toml(path.read_bytes().decode("utf-8"))
+            if dependency_local and _get_config(dependency_local, pyproject_path=path)["enable"]:
+                projects.append(path)
+                pending.append(path)
+    return projects
+
+
+def _get_version_from_file(config: _Config, path: Optional[Path] = None) -> Optional[str]:
     source = config["from-file"]["source"]
     pattern = config["from-file"]["pattern"]
 
     if source is None:
         return None
 
-    pyproject_path = _get_pyproject_path()
+    pyproject_path = _get_pyproject_path(path)
     if pyproject_path is None:
         raise RuntimeError("Unable to find pyproject.toml")
 
@@ -504,9 +799,357 @@ def _get_version_from_file(config: _Config) -> Optional[str]:
     return result.group(1)
 
 
+def _get_cache_dir() -> Path:
+    custom = os.environ.get(_CACHE_DIR_ENV)
+    if custom:
+        return Path(custom)
+
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or str(Path.home() / "AppData" / "Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "poetry-dynamic-versioning"
+
+
+def _get_server_socket() -> Path:
+    custom = os.environ.get(_SERVER_ENV)
+    if custom:
+        return Path(custom)
+    return _get_cache_dir() / "server.sock"
+
+
+def _find_git_dirs(path: Path) -> Optional[Tuple[Path, Path]]:
+    """
+    Find the Git directory for the worktree and the common directory that holds the refs.
+    """
+    for level in [path, *path.parents]:
+        dot_git = level / ".git"
+        if dot_git.is_dir():
+            git_dir = dot_git
+            break
+        elif dot_git.is_file():
+            # Linked worktrees and submodules use a file that points elsewhere.
+            content = dot_git.read_bytes().decode("utf-8").strip()
+            if not content.startswith("gitdir:"):
+                return None
+            git_dir = (level / content[len("gitdir:") :].strip()).resolve()
+            break
+    else:
+        return None
+
+    common_dir = git_dir
+    if (git_dir / "commondir").is_file():
+        common_dir = (git_dir / (git_dir / "commondir").read_bytes().decode("utf-8").strip()).resolve()
+
+    return (git_dir, common_dir)
+
+
+# Results of `_detect_vcs_from_markers` by starting folder,
+# along with the folders that it checked and their modification times.
+_vcs_markers = {}  # type: MutableMapping[Path, Tuple[Sequence[Path], Sequence[int], Optional[Vcs]]]
+
+
+def _get_folder_stamps(folders: Sequence[Path]) -> Sequence[int]:
+    stamps = []
+    for folder in folders:
+        try:
+            stamps.append(folder.stat().st_mtime_ns)
+        except OSError:
+            stamps.append(0)
+    return stamps
+
+
+def _detect_vcs_from_markers(path: Path) -> Optional["Vcs"]:
+    """
+    Find the kind of repository by looking for its files in the folder and its parents,
+    instead of letting Dunamai try each VCS's command until one works.
+    Returns None when Dunamai should detect it after all,
+    such as for an archive where it reads `.git_archival.json` or `.hg_archival.txt`.
+
+    Creating, deleting, or moving a marker updates the modification time of the folder that contains it,
+    so long-running processes like `watch` and `serve` reuse the result until one of those times changes.
+    """
+    from dunamai import Vcs
+
+    cached = _vcs_markers.get(path)
+    if cached is not None and _get_folder_stamps(cached[0]) == cached[1]:
+        return cached[2]
+
+    levels = [path, *path.parents]
+    stamps = _get_folder_stamps(levels)
+    result = None  # type: Optional[Vcs]
+    for i, level in enumerate(levels):
+        archival = level / ".git_archival.json"
+        if archival.is_file() and "$Format:" not in archival.read_bytes().decode("utf-8"):
+            break
+        if (level / ".hg_archival.txt").is_file():
+            break
+
+        found = next((vcs for marker, vcs in _VCS_MARKERS if (level / marker).exists()), None)
+        if found is not None:
+            _debug("Detected {} repository at '{}'".format(found, level))
+            result = Vcs(found)
+            break
+
+    # Only the folders up to where we stopped matter.
+    checked = i + 1
+    if len(_vcs_markers) >= 64:
+        _vcs_markers.clear()
+    _vcs_markers[path] = (levels[:checked], stamps[:checked], result)
+    return result
+
+
+def _vcs_fingerprint(path: Path) -> Optional[Tuple[Tuple[str, int], ...]]:
+    """
+    Summarize the modification times of the Git files that affect the version,
+    so that we can tell when a cached result is out of date.
+    This only covers Git; for other VCSes, the result is None.
+    """
+    dirs = _find_git_dirs(path)
+    if dirs is None:
+        return None
+    git_dir, common_dir = dirs
+
+    # The index isn't included because Git rewrites it whenever it refreshes the file stats.
+    # It only affects whether the repository is dirty, which we check separately anyway.
+    files = [git_dir / "HEAD", common_dir / "packed-refs", common_dir / "shallow"]
+    for root, _, _ in os.walk(str(common_dir / "refs")):
+        # Git replaces ref files via renames, which updates the folder's modification time.
+        files.append(Path(root))
+
+    fingerprint = []
+    for file in files:
+        try:
+            fingerprint.append((str(file), file.stat().st_mtime_ns))
+        except OSError:
+            fingerprint.append((str(file), 0))
+    return tuple(fingerprint)
+
+
+def _needs_dirty(config: _Config) -> bool:
+    for entry in [config, *config["formats"].values()]:
+        for template in [entry.get("format"), entry.get("format-jinja")]:
+            if template is not None and "dirty" in template:
+                return True
+        if entry.get("dirty"):
+            return True
+    return False
+
+
+def _unwrap_toml(value: Any) -> Any:
+    """
+    Convert Tomlkit containers and items, such as from `overrides`, to plain Python values.
+    """
+    if hasattr(value, "unwrap"):
+        return value.unwrap()
+    elif isinstance(value, dict):
+        return {k: _unwrap_toml(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_unwrap_toml(x) for x in value]
+    return value
+
+
+def _get_version_from_server(config: _Config, strict: bool, path: Optional[Path]) -> Optional["Version"]:
+    """
+    Ask a running `poetry-dynamic-versioning serve` process for the VCS info.
+    If there isn't one, or it can't answer, then the caller should query the VCS itself.
+    """
+    import socket
+
+    from dunamai import Concern
+
+    server = _get_server_socket()
+    if not hasattr(socket, "AF_UNIX") or not server.exists():
+        return None
+
+    request = {
+        "path": str((Path.cwd() if path is None else path).resolve()),
+        "config": _unwrap_toml(config),
+        "strict": strict,
+        "dirty": _needs_dirty(config),
+    }
+    try:
+        payload = json.dumps(request).encode("utf-8") + b"\n"
+    except (TypeError, ValueError) as e:
+        # For example, TOML dates in the config.
+        _debug("Unable to send config to version server: {}".format(e))
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(30)
+            client.connect(str(server))
+            client.sendall(payload)
+            response = json.loads(client.makefile("rb").readline().decode("utf-8"))
+    except (OSError, ValueError) as e:
+        _debug("Unable to use version server at '{}': {}".format(server, e))
+        return None
+
+    if "error" in response:
+        raise RuntimeError(response["error"])
+
+    version = _version_from_dict(response["version"])
+    version.concerns = {Concern(x) for x in response["concerns"]}
+    return version
+
+
+def _get_version_cache_file(path: Optional[Path]) -> Path:
+    import hashlib
+
+    key = str((Path.cwd() if path is None else path).resolve())
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return _get_cache_dir() / "versions" / "{}.json".format(digest)
+
+
+def _get_git_branch(path: Path) -> Optional[str]:
+    code, msg = _run_cmd("git symbolic-ref --short HEAD", codes=[0, 128], path=path)
+    return msg if code == 0 else None
+
+
+def _has_git_changes(path: Optional[Path]) -> Optional[bool]:
+    # Unlike `git diff-index`, this refreshes the file stats in memory,
+    # so files that were only touched aren't reported as changed.
+    code, _ = _run_cmd("git diff --quiet HEAD --", codes=(), path=path)
+    if code not in [0, 1]:
+        return None
+    return code == 1
+
+
+def _has_git_untracked_files(path: Optional[Path]) -> Optional[bool]:
+    code, output = _run_cmd(
+        "git ls-files --others --exclude-standard --directory --no-empty-directory", codes=(), path=path
+    )
+    if code != 0:
+        return None
+    return output != ""
+
+
+def _is_git_dirty(path: Optional[Path], ignore_untracked: bool) -> Optional[bool]:
+    """
+    Check for changes without `git status` or `git describe --dirty`, which rewrite the index.
+    Returns None if Git couldn't tell us.
+    """
+    changed = _has_git_changes(path)
+    if changed is None or changed or ignore_untracked:
+        return changed
+    return _has_git_untracked_files(path)
+
+
+def _parse_git_timestamp(raw: str) -> dt.datetime:
+    # Git's `%cI` and `iso-strict` formats, like `2024-01-02T03:04:05+01:00`.
+    return dt.datetime.fromisoformat(raw)
+
+
+class _TagMatch:
+    def __init__(
+        self,
+        name: str,
+        base: str,
+        stage_revision: Optional[Tuple[str, Optional[int]]],
+        tagged_metadata: Optional[str],
+        epoch: Optional[int],
+    ) -> None:
+        self.name = name
+        self.base = base
+        self.stage_revision = stage_revision
+        self.tagged_metadata = tagged_metadata
+        self.epoch = epoch
+
+
+def _match_tag(name: str, pattern: str) -> Optional[_TagMatch]:
+    """
+    Read the version parts from a tag, the same way that Dunamai does.
+
+    :param pattern: Regular expression from Dunamai's `Pattern.parse()`.
+    """
+    match = re.search(pattern, name)
+    if match is None:
+        return None
+
+    groups = match.groupdict()
+    if groups.get("base") is None:
+        return None
+    stage = groups.get("stage")
+    revision = groups.get("revision")
+    epoch = groups.get("epoch")
+    return _TagMatch(
+        name,
+        groups["base"],
+        (stage, None if revision is None else int(revision)) if stage is not None else None,
+        groups.get("tagged_metadata"),
+        int(epoch) if epoch is not None else None,
+    )
+
+
+def _find_matched_tag(
+    version: "Version", pattern: Union[str, "Pattern"], config: _Config, path: Optional[Path]
+) -> Optional[str]:
+    """
+    Find the tag that a Git version is based on,
+    or None if Dunamai had to fall back to the default version.
+    """
+    from dunamai import Pattern
+
+    parsed_pattern = Pattern.parse(pattern, config["pattern-prefix"])
+    stage_revision = (version.stage, version.revision) if version.stage is not None else None
+
+    _, msg = _run_cmd("git tag --merged {}".format(shlex.quote(config["tag-branch"] or "HEAD")), path=path)
+    for name in msg.splitlines():
+        match = _match_tag(name, parsed_pattern)
+        if match is None or (match.base, match.stage_revision, match.tagged_metadata, match.epoch) != (
+            version.base,
+            stage_revision,
+            version.tagged_metadata,
+            version.epoch,
+        ):
+            continue
+        # Several tags may have the same version, so we also compare the distance.
+        _, count = _run_cmd("git rev-list --count {}..HEAD".format(shlex.quote("refs/tags/{}".format(name))), path=path)
+        if int(count) == version.distance:
+            return name
+    return None
+
+
 def _get_version_from_dunamai(
-    vcs: Vcs, pattern: Union[str, Pattern], config: _Config, *, strict: Optional[bool] = None
-) -> Version:
+    vcs: "Vcs",
+    pattern: Union[str, "Pattern"],
+    config: _Config,
+    *,
+    strict: Optional[bool] = None,
+    path: Optional[Path] = None,
+    server: bool = True,
+    cache: bool = True,
+) -> "Version":
+    from dunamai import Version
+
+    # The hook cache comes first because it's the cheapest source,
+    # and it holds what the rest of this function returned when the hooks last ran,
+    # including the concerns that `_get_version` checks for `fix-shallow-repository`
+    # and the result of `max-tag-search-depth`, so it doesn't skip those decisions.
+    # Fetching more history changes the fingerprint, which invalidates the entry.
+    if cache:
+        from poetry_dynamic_versioning.cache import _get_version_from_cache
+
+        version = _get_version_from_cache(config, config["strict"] if strict is None else strict, path)
+        if version is not None:
+            return version
+
+    if server:
+        version = _get_version_from_server(config, config["strict"] if strict is None else strict, path)
+        if version is not None:
+            return version
+
+    if vcs.value == "any" and "GIT_DIR" not in os.environ:
+        vcs = _detect_vcs_from_markers((Path.cwd() if path is None else path).resolve()) or vcs
+
+    depth = config["max-tag-search-depth"]
+    if depth is not None and vcs.value in ("any", "git"):
+        version = _get_version_without_nearby_tag(
+            pattern, config, depth, config["strict"] if strict is None else strict, path
+        )
+        if version is not None:
+            return version
+
     return Version.from_vcs(
         vcs=vcs,
         pattern=pattern,
@@ -519,40 +1162,300 @@ def _get_version_from_dunamai(
         pattern_prefix=config["pattern-prefix"],
         ignore_untracked=config["ignore-untracked"],
         commit_length=config["commit-length"],
+        path=path,
+    )
+
+
+def _get_tag_search_anchor_file(path: Optional[Path]) -> Path:
+    return _get_version_cache_file(path).with_suffix(".anchor")
+
+
+def _get_anchor_distance(path: Path, boundary: str) -> int:
+    """
+    Count the commits since the anchor that we stored the first time the tag search hit its limit,
+    so that the distance keeps growing with new commits instead of being stuck at the limit.
+    """
+    file = _get_tag_search_anchor_file(path)
+    try:
+        anchor = file.read_bytes().decode("utf-8").strip()  # type: Optional[str]
+    except OSError:
+        anchor = None
+
+    if anchor:
+        code, _ = _run_cmd("git merge-base --is-ancestor {} HEAD".format(anchor), codes=[0, 1, 128], path=path)
+        if code == 0:
+            _, count = _run_cmd("git rev-list --count {}..HEAD".format(anchor), path=path)
+            return int(count)
+
+    # The anchor is missing, or it's no longer in the history after a rebase.
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_bytes(boundary.encode("utf-8"))
+    _, count = _run_cmd("git rev-list --count {}..HEAD".format(boundary), path=path)
+    return int(count)
+
+
+def _get_version_without_nearby_tag(
+    pattern: Union[str, "Pattern"], config: _Config, depth: int, strict: bool, path: Optional[Path]
+) -> Optional["Version"]:
+    """
+    Look for a matching tag in the last `max-tag-search-depth` commits, like `git describe --candidates`.
+    If there isn't one, return the fallback version, so that we never walk the rest of the history.
+    Returns None when Dunamai should look up the version as usual.
+    """
+    from dunamai import Pattern, Vcs, Version
+
+    path = Path.cwd() if path is None else path
+    if _find_git_dirs(path) is None:
+        return None
+
+    code, msg = _run_cmd(
+        'git -c log.showsignature=false log -n {} --decorate-refs=refs/tags --format="%H%x00%h%x00%cI%x00%D"'
+        " HEAD".format(depth),
+        codes=[],
+        path=path,
+    )
+    if code != 0:
+        return None
+    commits = [line.split("\x00") for line in msg.splitlines()]
+    if len(commits) < depth:
+        # We've already seen the whole history, so there's nothing to bound.
+        return None
+
+    parsed_pattern = Pattern.parse(pattern, config["pattern-prefix"])
+    for *_, decorations in commits:
+        for tag in decorations.split(", "):
+            if tag.startswith("tag: ") and (config["latest-tag"] or re.search(parsed_pattern, tag[5:]) is not None):
+                return None
+
+    if strict:
+        raise RuntimeError(
+            "No matching tag within the last {} commits and fallbacks disabled by strict mode".format(depth)
+        )
+
+    oid, short_oid, timestamp, _ = commits[0]
+    full_commit = config["full-commit"] or config["commit-length"] is not None
+    dirty = _is_git_dirty(path, config["ignore-untracked"])
+    _debug("No matching tag within the last {} commits of '{}'".format(depth, path))
+    return Version(
+        config["fallback-base"],
+        distance=_get_anchor_distance(path, commits[-1][0]),
+        commit=(oid if full_commit else short_oid)[: config["commit-length"]],
+        dirty=bool(dirty),
+        branch=_get_git_branch(path),
+        timestamp=_parse_git_timestamp(timestamp),
+        vcs=Vcs.Git,
+    )
+
+
+def _version_to_dict(version: "Version") -> Mapping:
+    return {
+        "base": version.base,
+        "stage": version.stage,
+        "revision": version.revision,
+        "distance": version.distance,
+        "commit": version.commit,
+        "dirty": version.dirty,
+        "tagged_metadata": version.tagged_metadata,
+        "epoch": version.epoch,
+        "branch": version.branch,
+        "timestamp": version.timestamp.isoformat() if version.timestamp is not None else None,
+        "vcs": version.vcs.value,
+    }
+
+
+def _version_from_dict(data: Mapping) -> "Version":
+    from dunamai import Vcs, Version
+
+    return Version(
+        data["base"],
+        stage=(data["stage"], data["revision"]) if data["stage"] is not None else None,
+        distance=data["distance"],
+        commit=data["commit"],
+        dirty=data["dirty"],
+        tagged_metadata=data["tagged_metadata"],
+        epoch=data["epoch"],
+        branch=data["branch"],
+        timestamp=dt.datetime.fromisoformat(data["timestamp"]) if data["timestamp"] is not None else None,
+        vcs=Vcs(data["vcs"]),
     )
 
 
-def _get_version(config: _Config, name: Optional[str] = None) -> Tuple[str, Version]:
+def _get_version(config: _Config, name: Optional[str] = None, path: Optional[Path] = None) -> Tuple[str, "Version"]:
+    from dunamai import Concern, Pattern, Vcs, Version
+
     override = _get_override_version(name)
     if override is not None:
         return (override, Version.parse(override))
 
-    override = _get_version_from_file(config)
+    override = _get_version_from_file(config, path)
     if override is not None:
         return (override, Version.parse(override))
 
     vcs = Vcs(config["vcs"])
-    style = Style(config["style"]) if config["style"] is not None else None
-
     pattern = config["pattern"] if config["pattern"] is not None else Pattern.Default  # type: Union[str, Pattern]
 
-    if config["fix-shallow-repository"]:
+    shallow_config = _ShallowConfig.from_config(config["fix-shallow-repository"])
+    if shallow_config.enable:
         # We start without strict so we can inspect the concerns.
-        version = _get_version_from_dunamai(vcs, pattern, config, strict=False)
+        version = _get_version_from_dunamai(vcs, pattern, config, strict=False, path=path)
         retry = config["strict"]
 
         if Concern.ShallowRepository in version.concerns and version.vcs == Vcs.Git:
-            retry = True
-            _run_cmd("git fetch --unshallow")
+            if shallow_config.strategy == "unshallow":
+                retry = True
+                _run_cmd("git fetch --unshallow", path=path)
+            else:
+                # The repository may still be shallow, which strict mode would reject outright,
+                # so we only enforce the part about needing a tag.
+                retry = False
+                version = _deepen_shallow_repository(vcs, pattern, config, shallow_config, path)
+                if config["strict"] and _find_matched_tag(version, pattern, config, path) is None:
+                    raise RuntimeError("No tags available and fallbacks disabled by strict mode")
 
         if retry:
-            version = _get_version_from_dunamai(vcs, pattern, config)
+            version = _get_version_from_dunamai(vcs, pattern, config, path=path)
     else:
-        version = _get_version_from_dunamai(vcs, pattern, config)
+        version = _get_version_from_dunamai(vcs, pattern, config, path=path)
 
     for concern in version.concerns:
         print("Warning: {}".format(concern.message()), file=sys.stderr)
 
+    return (_serialize_version(version, config), version)
+
+
+def _get_git_remote(path: Optional[Path]) -> str:
+    code, branch = _run_cmd("git symbolic-ref --short HEAD", codes=[0, 128], path=path)
+    if code == 0:
+        code, remote = _run_cmd("git config branch.{}.remote".format(shlex.quote(branch)), codes=[0, 1], path=path)
+        if code == 0 and remote:
+            return remote
+    return "origin"
+
+
+def _get_git_object_size(path: Optional[Path]) -> int:
+    _, msg = _run_cmd("git count-objects -v", path=path)
+    size = 0
+    for line in msg.splitlines():
+        key, _, value = line.partition(": ")
+        if key in ["size", "size-pack"]:
+            size += int(value) * 1024
+    return size
+
+
+def _is_history_complete(tag: str, shallow_file: Path, path: Optional[Path]) -> bool:
+    """
+    Check that we have every commit between the tag and HEAD,
+    so that the distance isn't missing any commits cut off on other branches.
+    """
+    try:
+        shallow = set(shallow_file.read_bytes().decode("utf-8").split())
+    except OSError:
+        return True
+    _, msg = _run_cmd("git rev-list {}..HEAD".format(shlex.quote("refs/tags/{}".format(tag))), path=path)
+    return shallow.isdisjoint(msg.split())
+
+
+def _get_remote_tags(remote: str, path: Optional[Path]) -> Mapping[str, str]:
+    """
+    List the remote's tags and the commits that they point to, without downloading anything.
+    """
+    _, msg = _run_cmd("git ls-remote --tags {}".format(shlex.quote(remote)), path=path)
+
+    direct = {}  # type: MutableMapping[str, str]
+    peeled = {}  # type: MutableMapping[str, str]
+    for line in msg.splitlines():
+        oid, _, ref = line.partition("\t")
+        if not ref.startswith("refs/tags/"):
+            continue
+        name = ref[len("refs/tags/") :]
+        if name.endswith("^{}"):
+            peeled[name[:-3]] = oid
+        else:
+            direct[name] = oid
+
+    return {name: peeled.get(name, oid) for name, oid in direct.items()}
+
+
+def _deepen_shallow_repository(
+    vcs: "Vcs",
+    pattern: Union[str, "Pattern"],
+    config: _Config,
+    shallow_config: _ShallowConfig,
+    path: Optional[Path],
+) -> "Version":
+    """
+    Fetch just enough history to reach the nearest tag.
+    We list the remote's tags without fetching anything,
+    then deepen the history from HEAD in growing steps until one of the tagged commits shows up.
+    """
+    from dunamai import Concern, Pattern
+
+    dirs = _find_git_dirs(Path.cwd() if path is None else path)
+    if dirs is None:
+        raise RuntimeError("Unable to find the Git directory")
+    shallow_file = dirs[1] / "shallow"
+
+    started = time.perf_counter()
+    size = _get_git_object_size(path)
+    remote = _get_git_remote(path)
+    options = " --filter={}".format(shlex.quote(shallow_config.filter)) if shallow_config.filter else ""
+
+    parsed_pattern = Pattern.parse(pattern, config["pattern-prefix"])
+    candidates = {
+        name: oid
+        for name, oid in _get_remote_tags(remote, path).items()
+        if config["latest-tag"] or re.search(parsed_pattern, name) is not None
+    }
+
+    fetched = set()  # type: set
+    step = _SHALLOW_DEEPEN_STEP
+    # Where to start looking for tagged commits: at first, the whole history that we have,
+    # and after that, only the commits behind the previous boundary, which are the ones we just fetched.
+    tips = "HEAD"
+    while True:
+        _, msg = _run_cmd("git rev-list {}".format(tips), path=path)
+        new_commits = set(msg.split())
+        reachable = [name for name, oid in candidates.items() if oid in new_commits and name not in fetched]
+        if reachable:
+            # We already have these commits, so this only creates the tags.
+            refspecs = " ".join(shlex.quote("+refs/tags/{0}:refs/tags/{0}".format(x)) for x in reachable)
+            _run_cmd("git fetch -q --no-tags {} {}".format(shlex.quote(remote), refspecs), path=path)
+            fetched.update(reachable)
+
+        if fetched or not shallow_file.exists():
+            version = _get_version_from_dunamai(
+                vcs, pattern, config, strict=False, path=path, server=False, cache=False
+            )
+            if Concern.ShallowRepository not in version.concerns:
+                break
+
+            tag = _find_matched_tag(version, pattern, config, path)
+            if tag is not None and _is_history_complete(tag, shallow_file, path):
+                # We have what we need for the version, even though the repository is still shallow.
+                version.concerns.discard(Concern.ShallowRepository)
+                break
+
+        boundary = shallow_file.read_bytes()
+        _run_cmd("git fetch -q --deepen={}{} {}".format(step, options, shlex.quote(remote)), path=path)
+        if shallow_file.exists() and shallow_file.read_bytes() == boundary:
+            # Nothing more to fetch this way.
+            _run_cmd("git fetch -q --unshallow{} {}".format(options, shlex.quote(remote)), path=path)
+        step *= 2
+        tips = " ".join(boundary.decode("utf-8").split())
+
+    _debug(
+        "Deepened shallow repository in {:.1f} s, downloading {} KiB".format(
+            time.perf_counter() - started, max(0, _get_git_object_size(path) - size) // 1024
+        )
+    )
+    return version
+
+
+def _serialize_version(version: "Version", config: _Config) -> str:
+    from dunamai import check_version, Style
+
+    style = Style(config["style"]) if config["style"] is not None else None
+
     if config["format-jinja"]:
         serialized = _render_jinja(version, config["format-jinja"], config)
         if style is not None:
@@ -574,14 +1477,20 @@ def _get_version(config: _Config, name: Optional[str] = None) -> Tuple[str, Vers
             escape_with=config["escape-with"],
         )
 
-    return (serialized, version)
+    return serialized
 
 
-def _substitute_version(name: str, version: str, folders: Sequence[_FolderConfig]) -> None:
-    if _state.projects[name].substitutions:
-        # Already ran; don't need to repeat.
-        return
+def _serialize_formats(version: "Version", config: _Config) -> Mapping[str, str]:
+    formats = {}  # type: MutableMapping[str, str]
+    for name, options in config["formats"].items():
+        # Each named format brings its own `format` or `format-jinja`,
+        # but other options like `style` fall back to the main settings.
+        named = {**config, "format": None, "format-jinja": None, **options}
+        formats[name] = _serialize_version(version, named)  # type: ignore
+    return formats
+
 
+def _find_substitution_files(folders: Sequence[_FolderConfig]) -> Mapping[Path, _FolderConfig]:
     files = {}  # type: MutableMapping[Path, _FolderConfig]
     for folder in folders:
         for file_glob in folder.files:
@@ -598,16 +1507,104 @@ def _substitute_version(name: str, version: str, folders: Sequence[_FolderConfig
             if i == 0:
                 _debug("No files found for substitution with glob '{}' in folder '{}'".format(file_glob, folder.path))
 
+    return files
+
+
+def _substitute_version(
+    name: str, version: str, folders: Sequence[_FolderConfig], session: Optional[_State] = None
+) -> None:
+    session = _get_session(session)
+    with session.lock:
+        state = session.projects[name]
+        resolution = session.resolutions.get(str(state.path.resolve()))
+    if state.substitutions:
+        # Already ran; don't need to repeat.
+        return
+
+    if resolution is not None and "substitutions" in resolution:
+        # An earlier build hook already found the relevant files.
+        files = {
+            Path(file): folders[index] for file, index in resolution["substitutions"].items()
+        }  # type: Mapping[Path, _FolderConfig]
+    else:
+        files = _find_substitution_files(folders)
+
     for file, config in files.items():
         original_content = file.read_bytes().decode("utf-8")
         new_content = _substitute_version_in_text(version, original_content, config.patterns)
         if original_content != new_content:
-            _state.projects[name].substitutions[file] = original_content
+            state.substitutions[file] = original_content
+            state.substitution_folders[file] = folders.index(config)
             file.write_bytes(new_content.encode("utf-8"))
         else:
             _debug("No changes made during substitution in file '{}'".format(file))
 
 
+def _format_version_tuple(version: str) -> str:
+    parts = []
+    split = version.split("+", 1)
+    split = [*re.split(r"[-.]", split[0]), *split[1:]]
+    for part in split:
+        if part == "":
+            continue
+        try:
+            parts.append(str(int(part)))
+        except ValueError:
+            parts.append('"{}"'.format(part))
+    formatted = ", ".join(parts)
+    if len(parts) == 1:
+        formatted += ","
+    return formatted
+
+
+def _render_version_module(version: str, instance: "Version") -> str:
+    return textwrap.dedent(
+        """\
+        # This file is generated by poetry-dynamic-versioning.
+        from __future__ import annotations
+
+        __version__: str = {}
+        __version_tuple__: tuple[int | str, ...] = ({})
+        __commit__: str | None = {}
+        __distance__: int = {}
+        """
+    ).format(
+        json.dumps(version),
+        _format_version_tuple(version),
+        json.dumps(instance.commit) if instance.commit is not None else "None",
+        instance.distance,
+    )
+
+
+def _render_version_shim(version: str, instance: "Version", root: Path, file: Path) -> str:
+    """
+    Extend the version module for editable installs,
+    so that it picks up new commits at import time without a reinstall.
+    The values in the module are still used as long as Git's `HEAD` hasn't moved.
+    After that, the module reads the version that `poetry-dynamic-versioning refresh-cache`
+    stored for the new commit, running that command first if needed.
+    The code comes from `_version_shim.py`.
+    """
+    if _find_git_dirs(root) is None:
+        # Only Git is supported, so there's nothing to refresh.
+        return _render_version_module(version, instance)
+
+    code, head = _run_cmd("git rev-parse --verify -q HEAD", codes=[], path=root)
+    try:
+        relative = file.resolve().relative_to(root.resolve()).as_posix()
+    except ValueError:
+        # The shim finds the project relative to its own location.
+        return _render_version_module(version, instance)
+    if code != 0:
+        return _render_version_module(version, instance)
+
+    shim = (Path(__file__).parent / "_version_shim.py").read_bytes().decode("utf-8")
+    shim = "\n" + shim.split("# --- shim ---\n", 1)[1]
+    shim = shim.replace('\n_PATH = ""\n', "\n_PATH = {}\n".format(json.dumps(relative)), 1)
+    shim = shim.replace('\n_HEAD = ""\n', "\n_HEAD = {}\n".format(json.dumps(head)), 1)
+    return _render_version_module(version, instance) + shim
+
+
 def _substitute_version_in_text(version: str, content: str, patterns: Sequence[_SubPattern]) -> str:
     new_content = content
 
@@ -615,19 +1612,7 @@ def _substitute_version_in_text(version: str, content: str, patterns: Sequence[_
         if pattern.mode == "str":
             insert = version
         elif pattern.mode == "tuple":
-            parts = []
-            split = version.split("+", 1)
-            split = [*re.split(r"[-.]", split[0]), *split[1:]]
-            for part in split:
-                if part == "":
-                    continue
-                try:
-                    parts.append(str(int(part)))
-                except ValueError:
-                    parts.append('"{}"'.format(part))
-            insert = ", ".join(parts)
-            if len(parts) == 1:
-                insert += ","
+            insert = _format_version_tuple(version)
         else:
             raise ValueError("Invalid substitution mode: {}".format(pattern.mode))
 
@@ -636,38 +1621,82 @@ def _substitute_version_in_text(version: str, content: str, patterns: Sequence[_
     return new_content
 
 
-def _apply_version(
-    name: str,
-    version: str,
-    instance: Version,
-    config: _Config,
-    pyproject_path: Path,
-    mode: _Mode,
-    retain: bool = False,
-) -> None:
-    pyproject = tomlkit.parse(pyproject_path.read_bytes().decode("utf-8"))
+def _get_substitution_target(config: _Config, retain: bool = False, session: Optional[_State] = None) -> _Target:
+    if retain or _get_session(session).cli_mode:
+        # On-demand application always leaves the changes in the source tree.
+        return _Target.Source
+    return _Target(config["substitution"]["target"])
+
 
+def _set_version_in_pyproject(pyproject: Mapping, version: str, mode: _Mode, disable: bool) -> bool:
+    """
+    Returns whether `inherit = true` was removed, so that it can be restored later.
+    """
     if mode == _Mode.Classic:
         pyproject["tool"]["poetry"]["version"] = version  # type: ignore
     elif mode == _Mode.Pep621:
-        if "version" in pyproject["project"]["dynamic"]:  # type: ignore
+        if "version" in pyproject["project"]["dynamic"]:
             pyproject["project"]["dynamic"].remove("version")  # type: ignore
         pyproject["project"]["version"] = version  # type: ignore
-        if "version" in pyproject["tool"]["poetry"]:  # type: ignore
+        if "version" in pyproject["tool"]["poetry"]:
             pyproject["tool"]["poetry"].pop("version")  # type: ignore
 
     # Disable the plugin in case we're building a source distribution,
     # which won't have access to the VCS info at install time.
     # We revert this later when we deactivate.
-    if not retain and not _state.cli_mode:
+    inherit = False
+    if disable:
         pyproject["tool"]["poetry-dynamic-versioning"]["enable"] = False  # type: ignore
+        # A source distribution doesn't include the parent config either.
+        inherit = bool(pyproject["tool"]["poetry-dynamic-versioning"].pop("inherit", False))  # type: ignore
+    return inherit
+
+
+def _write_if_changed(path: Path, content: bytes) -> bool:
+    # Leaving identical files alone keeps their modification times,
+    # so tools that watch them (and our own fingerprints) don't see a change.
+    try:
+        if path.read_bytes() == content:
+            return False
+    except OSError:
+        pass
+    path.write_bytes(content)
+    return True
 
-    pyproject_path.write_bytes(tomlkit.dumps(pyproject).encode("utf-8"))
+
+def _apply_version(
+    name: str,
+    version: str,
+    instance: "Version",
+    config: _Config,
+    pyproject_path: Path,
+    mode: _Mode,
+    retain: bool = False,
+    session: Optional[_State] = None,
+) -> None:
+    import tomlkit
+
+    session = _get_session(session)
+    target = _get_substitution_target(config, retain, session)
+
+    if target == _Target.Source:
+        pyproject = tomlkit.parse(pyproject_path.read_bytes().decode("utf-8"))
+        inherit = _set_version_in_pyproject(pyproject, version, mode, disable=not retain and not session.cli_mode)
+        with session.lock:
+            session.projects[name].inherit = inherit
+        _write_if_changed(pyproject_path, tomlkit.dumps(pyproject).encode("utf-8"))
 
     for file_name, file_info in config["files"].items():
         full_file = pyproject_path.parent.joinpath(file_name)
 
-        if file_info["initial-content-jinja"] is not None:
+        if file_info["version-module"]:
+            full_file.parent.mkdir(parents=True, exist_ok=True)
+            if file_info["version-module"] == "editable":
+                content = _render_version_shim(version, instance, pyproject_path.parent, full_file)
+            else:
+                content = _render_version_module(version, instance)
+            _write_if_changed(full_file, content.encode("utf-8"))
+        elif file_info["initial-content-jinja"] is not None:
             if not full_file.parent.exists():
                 full_file.parent.mkdir()
             initial = textwrap.dedent(
@@ -678,17 +1707,22 @@ def _apply_version(
                     {"formatted_version": version},
                 )
             )
-            full_file.write_bytes(initial.encode("utf-8"))
+            _write_if_changed(full_file, initial.encode("utf-8"))
         elif file_info["initial-content"] is not None:
             if not full_file.parent.exists():
                 full_file.parent.mkdir()
             initial = textwrap.dedent(file_info["initial-content"])
-            full_file.write_bytes(initial.encode("utf-8"))
+            _write_if_changed(full_file, initial.encode("utf-8"))
+
+    if target == _Target.Artifacts:
+        # Substitution happens later in the built wheel/sdist instead.
+        return
 
     _substitute_version(
         name,  # type: ignore
         version,
         _FolderConfig.from_config(config, pyproject_path.parent),
+        session,
     )
 
 
@@ -697,12 +1731,62 @@ def _get_and_apply_version(
     retain: bool = False,
     force: bool = False,
     io: bool = True,
+    session: Optional[_State] = None,
+    overrides: Optional[Mapping] = None,
 ) -> Optional[str]:
+    session = _get_session(session)
+
     if pyproject_path is None:
         pyproject_path = _get_pyproject_path()
         if pyproject_path is None:
             raise RuntimeError("Unable to find pyproject.toml")
 
+    # Poetry recreates each path dependency several times while locking/installing,
+    # so we skip parsing when the file hasn't changed since we last looked at it.
+    key = str(pyproject_path.resolve())
+    fingerprint = _get_file_fingerprint(pyproject_path)
+    with session.lock:
+        outcome = session.outcomes.get(key)
+        if outcome is not None and outcome.fingerprint == fingerprint:
+            if outcome.name is not None and outcome.name in session.projects:
+                return outcome.name
+            if outcome.name is None or (not outcome.enabled and not force):
+                return None
+
+    if not session.share_results or not io or retain or session.cli_mode:
+        return _parse_and_apply_version(pyproject_path, key, fingerprint, retain, force, io, session, overrides)
+
+    # When several processes build the same project in parallel,
+    # the first one applies the version and the others reuse it.
+    shared_file = _get_shared_file(pyproject_path)
+    handle = _acquire_lock(shared_file.with_suffix(".lock"))
+    if handle is None:
+        return _parse_and_apply_version(pyproject_path, key, fingerprint, retain, force, io, session, overrides)
+
+    try:
+        inputs = _get_shared_inputs(pyproject_path, overrides)
+        name = _adopt_shared_version(shared_file, inputs, session)
+        if name is None:
+            name = _parse_and_apply_version(pyproject_path, key, fingerprint, retain, force, io, session, overrides)
+            if name is not None:
+                _publish_shared_version(shared_file, inputs, name, session)
+        return name
+    finally:
+        _release_lock(handle)
+
+
+def _parse_and_apply_version(
+    pyproject_path: Path,
+    key: str,
+    fingerprint: Tuple[int, int],
+    retain: bool,
+    force: bool,
+    io: bool,
+    session: _State,
+    overrides: Optional[Mapping],
+) -> Optional[str]:
+    import tomlkit
+
     # The actual type is `tomlkit.TOMLDocument`, which is important to preserve formatting,
     # but it also causes a lot of type-checking noise.
     pyproject = tomlkit.parse(pyproject_path.read_bytes().decode("utf-8"))  # type: Mapping
@@ -723,48 +1807,496 @@ def _get_and_apply_version(
         name = pyproject["tool"]["poetry"]["name"]
         original = pyproject["tool"]["poetry"]["version"]
         dynamic_array = None
+        mode = _Mode.Classic
     elif pep621:
         name = pyproject["project"]["name"]
         original = pyproject["tool"]["poetry"]["version"]
         dynamic_array = pyproject["project"]["dynamic"]
+        mode = _Mode.Pep621
     else:
+        with session.lock:
+            session.outcomes[key] = _Outcome(fingerprint, None, False)
         return None
 
-    if name in _state.projects:
+    if mode == _Mode.Classic and original is None:
         return name
 
-    config = _get_config(pyproject)
-    if not config["enable"] and not force:
-        return name if name in _state.projects else None
+    config = _get_config(pyproject, overrides, pyproject_path)
+
+    with session.lock:
+        if name in session.projects:
+            session.outcomes[key] = _Outcome(fingerprint, name, True)
+            return name
+
+        if not config["enable"] and not force:
+            session.outcomes[key] = _Outcome(fingerprint, name, False)
+            return None
+
+        resolution = session.resolutions.get(key)
+        prefetched = session.prefetched.pop(key, None)
+
+    # We don't hold the lock while querying the VCS so that other projects can proceed.
+    if resolution is not None:
+        version = resolution["version"]
+        instance = _version_from_dict(resolution["instance"])
+    elif prefetched is not None and prefetched[0] == fingerprint:
+        version, instance = prefetched[1].result()
+    else:
+        version, instance = _get_version(config, name, pyproject_path.parent)
+
+    target = _get_substitution_target(config, retain, session)
+
+    with session.lock:
+        if name in session.projects:
+            # Another thread got here first.
+            return name
+        session.projects[name] = _ProjectState(
+            pyproject_path,
+            original,
+            version,
+            mode,
+            dynamic_array,
+            io=io and target == _Target.Source,
+            instance=instance,
+        )
+
+    if io:
+        _apply_version(name, version, instance, config, pyproject_path, mode, retain, session)
+
+    # Applying the version may have rewritten the file.
+    with session.lock:
+        session.outcomes[key] = _Outcome(_get_file_fingerprint(pyproject_path), name, config["enable"])
+    return name
+
+
+def _get_path_dependencies(pyproject: Mapping) -> Sequence[str]:
+    poetry = pyproject.get("tool", {}).get("poetry", {})
+    tables = [poetry.get("dependencies", {}), poetry.get("dev-dependencies", {})]
+    for group in poetry.get("group", {}).values():
+        tables.append(group.get("dependencies", {}))
+
+    paths = []
+    for table in tables:
+        for spec in table.values():
+            for constraint in spec if isinstance(spec, list) else [spec]:
+                if isinstance(constraint, dict) and "path" in constraint:
+                    paths.append(constraint["path"])
+
+    # PEP 621 projects can use direct references like `foo @ file:///path/to/foo`.
+    project = pyproject.get("project", {})
+    requirements = list(project.get("dependencies", []))
+    for extra in project.get("optional-dependencies", {}).values():
+        requirements.extend(extra)
+    for requirement in requirements:
+        path = _get_requirement_path(requirement)
+        if path is not None:
+            paths.append(path)
+
+    return paths
+
+
+def _get_requirement_path(requirement: str) -> Optional[str]:
+    from urllib.parse import unquote, urlparse
+    from urllib.request import url2pathname
+
+    if "@" not in requirement:
+        return None
+    url = requirement.split("@", 1)[1].split(";", 1)[0].strip()
+    parsed = urlparse(url)
+    if parsed.scheme != "file" or parsed.netloc not in ["", "localhost"]:
+        return None
+    return url2pathname(unquote(parsed.path))
+
+
+def _prefetch_versions(pyproject_path: Path, session: Optional[_State] = None) -> None:
+    """
+    Start resolving the versions of the project's path dependencies in the background,
+    so that they're ready by the time that Poetry loads each dependency.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    session = _get_session(session)
+    local = _get_local_config_from_path(pyproject_path.parent)
+    if not local:
+        return
+
+    executor = None
+    for dependency in _get_path_dependencies(local):
+        path = (pyproject_path.parent / dependency / "pyproject.toml").resolve()
+        key = str(path)
+        if not path.is_file() or key in session.prefetched or key in session.resolutions:
+            continue
+
+        fingerprint = _get_file_fingerprint(path)
+        dependency_local = _load_toml(path.read_bytes().decode("utf-8"))
+        name = dependency_local.get("tool", {}).get("poetry", {}).get("name")
+        if name is None:
+            name = dependency_local.get("project", {}).get("name")
+        if name is None or name in session.projects:
+            continue
+
+        config = _get_config(dependency_local, pyproject_path=path)
+        if not config["enable"]:
+            continue
+
+        if executor is None:
+            executor = ThreadPoolExecutor(thread_name_prefix="poetry-dynamic-versioning")
+        _debug("Prefetching version for path dependency '{}'".format(name))
+        with session.lock:
+            session.prefetched[key] = (fingerprint, executor.submit(_get_version, config, name, path.parent))
+
+    if executor is not None:
+        # The futures still complete; we just don't wait for them here.
+        executor.shutdown(wait=False)
+
+
+def _save_resolutions(file: Path, applied: bool = False, session: Optional[_State] = None) -> None:
+    session = _get_session(session)
+    with session.lock:
+        states = list(session.projects.items())
+
+    projects = {}
+    for name, state in states:
+        if state.instance is None:
+            continue
+        projects[str(state.path.resolve())] = _project_state_to_dict(name, state, applied)
+
+    file.write_bytes(json.dumps({"projects": projects}).encode("utf-8"))
+
+
+def _project_state_to_dict(name: str, state: _ProjectState, applied: bool) -> Mapping:
+    result = {
+        "version": state.version,
+        "instance": _version_to_dict(state.instance),  # type: ignore
+        "substitutions": {str(file): index for file, index in state.substitution_folders.items()},
+    }  # type: MutableMapping
+    if applied:
+        # Enough information for another process to revert the changes.
+        result["applied"] = {
+            "name": name,
+            "original_version": state.original_version,
+            "mode": state.mode.value,
+            "dynamic_array": list(state.dynamic_array) if state.dynamic_array is not None else None,
+            "substitutions": {str(file): content for file, content in state.substitutions.items()},
+            "io": state.io,
+            "inherit": state.inherit,
+        }
+    return result
+
+
+def _project_state_from_dict(path: str, resolution: Mapping) -> Tuple[str, _ProjectState]:
+    info = resolution["applied"]
+    state = _ProjectState(
+        Path(path),
+        info["original_version"],
+        resolution["version"],
+        _Mode(info["mode"]),
+        info["dynamic_array"],
+        {Path(file): content for file, content in info["substitutions"].items()},
+        io=info["io"],
+        instance=_version_from_dict(resolution["instance"]),
+    )
+    state.substitution_folders.update({Path(file): index for file, index in resolution["substitutions"].items()})
+    state.inherit = info.get("inherit", False)
+    return (info["name"], state)
+
+
+def _load_resolutions(file: Path, applied: bool = False, session: Optional[_State] = None) -> None:
+    if not file.is_file():
+        return
+
+    session = _get_session(session)
+    data = json.loads(file.read_bytes().decode("utf-8"))
+    with session.lock:
+        session.resolutions.update(data["projects"])
+
+    if not applied:
+        return
+
+    for path, resolution in data["projects"].items():
+        if "applied" not in resolution:
+            continue
+        name, state = _project_state_from_dict(path, resolution)
+        with session.lock:
+            session.projects[name] = state
+
+
+def _get_shared_file(pyproject_path: Path) -> Path:
+    import hashlib
+
+    digest = hashlib.sha256(str(pyproject_path.resolve()).encode("utf-8")).hexdigest()[:16]
+    return _get_cache_dir() / "shared" / "{}.json".format(digest)
+
 
-    initial_dir = Path.cwd()
-    target_dir = pyproject_path.parent
-    os.chdir(str(target_dir))
+def _get_content_hash(path: Path) -> Optional[str]:
+    import hashlib
+
+    try:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+def _acquire_lock(file: Path, timeout: float = 60) -> Optional[BinaryIO]:
+    """
+    Take an exclusive lock on a file, waiting up to the timeout for other processes.
+    Returns the open file handle to pass to `_release_lock`,
+    or None if the lock couldn't be acquired.
+    """
     try:
-        version, instance = _get_version(config, name)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(str(file), "a+b")
+    except OSError as e:
+        _debug("Unable to open lock file '{}': {}".format(file, e))
+        return None
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return handle
+        except OSError:
+            if time.monotonic() > deadline:
+                _debug("Timed out waiting for lock file '{}'".format(file))
+                handle.close()
+                return None
+            time.sleep(0.05)
+
+
+def _release_lock(handle: BinaryIO) -> None:
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
     finally:
-        os.chdir(str(initial_dir))
+        handle.close()
+
+
+def _get_shared_inputs(pyproject_path: Path, overrides: Optional[Mapping]) -> str:
+    """
+    Summarize what the version depends on besides pyproject.toml itself,
+    so that we don't reuse a version that another process applied with different settings.
+    The applied pyproject.toml is checked separately, since we can no longer parse its original config.
+    """
+    import hashlib
+
+    manifest = os.environ.get(_MANIFEST_ENV)
+    manifest_path = Path(manifest) if manifest else None
+    inputs = {
+        "env": {x: os.environ.get(x) for x in [_BYPASS_ENV, _OVERRIDE_ENV, _MANIFEST_ENV]},
+        "manifest": (
+            _get_content_hash(manifest_path) if manifest_path is not None and manifest_path.is_file() else None
+        ),
+        "overrides": overrides,
+        "inherited": _get_inherited_config(pyproject_path, required=False),
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+_holder = None  # type: Optional[Tuple[int, str, BinaryIO]]
+_holder_lock = threading.Lock()
+
+
+def _get_holder_id() -> Optional[str]:
+    """
+    Identify this process in shared version records.
+    We keep a lock on a file for as long as the process lives,
+    so that others can tell whether we're still around, unlike with a process ID, which can be reused.
+    """
+    global _holder
+
+    with _holder_lock:
+        # A forked child inherits the handle, but it needs its own identity.
+        if _holder is None or _holder[0] != os.getpid():
+            holder_id = "{}-{}".format(os.getpid(), os.urandom(8).hex())
+            handle = _acquire_lock(_get_cache_dir() / "shared" / "holders" / holder_id, timeout=0)
+            if handle is None:
+                return None
+            _holder = (os.getpid(), holder_id, handle)
+            atexit.register(_drop_holder_id)
+        return _holder[1]
+
+
+def _drop_holder_id() -> None:
+    global _holder
+
+    with _holder_lock:
+        if _holder is None or _holder[0] != os.getpid():
+            return
+        _, holder_id, handle = _holder
+        _holder = None
+
+    _release_lock(handle)
+    try:
+        (_get_cache_dir() / "shared" / "holders" / holder_id).unlink()
+    except OSError:
+        pass
 
-    if classic and name is not None and original is not None:
-        mode = _Mode.Classic
-        _state.projects[name] = _ProjectState(pyproject_path, original, version, mode, dynamic_array)
-        if io:
-            _apply_version(name, version, instance, config, pyproject_path, mode, retain)
-    elif pep621 and name is not None:
-        mode = _Mode.Pep621
-        _state.projects[name] = _ProjectState(pyproject_path, original, version, mode, dynamic_array)
-        if io:
-            _apply_version(name, version, instance, config, pyproject_path, mode, retain)
 
+def _is_holder_alive(holder_id: str) -> bool:
+    if _holder is not None and _holder[0] == os.getpid() and holder_id == _holder[1]:
+        return True
+
+    file = _get_cache_dir() / "shared" / "holders" / holder_id
+    if not file.exists():
+        return False
+
+    handle = _acquire_lock(file, timeout=0)
+    if handle is None:
+        return True
+
+    # The process released its lock when it exited.
+    _release_lock(handle)
+    try:
+        file.unlink()
+    except OSError:
+        pass
+    return False
+
+
+def _write_shared_file(file: Path, data: Mapping) -> None:
+    # The record includes the original contents of the project files, so other users shouldn't see it.
+    fd = os.open(str(file), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(json.dumps(data).encode("utf-8"))
+
+
+def _read_shared_file(file: Path) -> Optional[MutableMapping]:
+    try:
+        data = json.loads(file.read_bytes().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+
+    data["holders"] = [x for x in data["holders"] if isinstance(x, str) and _is_holder_alive(x)]
+    if not data["holders"]:
+        # Whoever applied the version is gone, so there's nothing left to share.
+        file.unlink()
+        return None
+    return data
+
+
+def _adopt_shared_version(file: Path, inputs: str, session: _State) -> Optional[str]:
+    data = _read_shared_file(file)
+    if data is None:
+        return None
+
+    # A run that was killed before it could revert leaves the applied files behind,
+    # so we only trust the record if the file still contains what that run wrote.
+    if data.get("content") is None or data["content"] != _get_content_hash(Path(data["path"])):
+        _debug("Ignoring stale shared version record for '{}'".format(data["path"]))
+        file.unlink()
+        return None
+
+    if data.get("inputs") != inputs:
+        # The other process is still using its version, so we leave the record alone.
+        _debug("Not reusing version applied by another process for '{}' with different settings".format(data["path"]))
+        return None
+
+    holder_id = _get_holder_id()
+    if holder_id is None:
+        return None
+
+    name, state = _project_state_from_dict(data["path"], data["project"])
+    state.shared = True
+    with session.lock:
+        session.projects[name] = state
+
+    data["holders"].append(holder_id)
+    _write_shared_file(file, data)
+    _debug("Reusing version {} applied by another process for '{}'".format(state.version, name))
     return name
 
 
-def _revert_version(retain: bool = False) -> None:
-    for project, state in _state.projects.items():
+def _publish_shared_version(file: Path, inputs: str, name: str, session: _State) -> None:
+    with session.lock:
+        state = session.projects.get(name)
+    if state is None or not state.io or state.instance is None:
+        return
+
+    if _read_shared_file(file) is not None:
+        # Another process with different settings still relies on its own record.
+        return
+
+    holder_id = _get_holder_id()
+    if holder_id is None:
+        return
+
+    state.shared = True
+    data = {
+        "path": str(state.path.resolve()),
+        "project": _project_state_to_dict(name, state, applied=True),
+        "content": _get_content_hash(state.path),
+        "inputs": inputs,
+        "holders": [holder_id],
+    }
+    _write_shared_file(file, data)
+
+
+def _release_shared_version(state: _ProjectState) -> bool:
+    """
+    Stop relying on a shared version.
+    Returns whether this process was the last user and should therefore revert the changes.
+    """
+    file = _get_shared_file(state.path)
+    handle = _acquire_lock(file.with_suffix(".lock"))
+    if handle is None:
+        return True
+
+    try:
+        data = _read_shared_file(file)
+        if data is None:
+            return True
+
+        if _holder is not None and _holder[1] in data["holders"]:
+            data["holders"].remove(_holder[1])
+        if data["holders"]:
+            _write_shared_file(file, data)
+            return False
+
+        file.unlink()
+        return True
+    finally:
+        _release_lock(handle)
+
+
+def _revert_version(
+    retain: bool = False, session: Optional[_State] = None, names: Optional[Sequence[str]] = None
+) -> None:
+    import tomlkit
+
+    session = _get_session(session)
+    with session.lock:
+        # Take ownership of the projects so that concurrent reverts don't repeat the work.
+        projects = [(name, state) for name, state in session.projects.items() if names is None or name in names]
+        for name, _ in projects:
+            del session.projects[name]
+
+    for project, state in projects:
+        if not state.io:
+            continue
+
+        if state.shared and not _release_shared_version(state):
+            _debug("Leaving version applied for '{}' since another process is still using it".format(project))
+            continue
+
         pyproject = tomlkit.parse(state.path.read_bytes().decode("utf-8"))
 
         if state.substitutions:
-            config = _get_config(pyproject)
+            config = _get_config(pyproject, pyproject_path=state.path)
 
             persistent = []
             for file, file_info in config["files"].items():
@@ -791,9 +2323,165 @@ def _revert_version(retain: bool = False) -> None:
             if state.original_version is not None:
                 pyproject["tool"]["poetry"]["version"] = state.original_version  # type: ignore
 
-        if not retain and not _state.cli_mode:
+        if not retain and not session.cli_mode:
             pyproject["tool"]["poetry-dynamic-versioning"]["enable"] = True  # type: ignore
+            if state.inherit:
+                pyproject["tool"]["poetry-dynamic-versioning"]["inherit"] = True  # type: ignore
 
         state.path.write_bytes(tomlkit.dumps(pyproject).encode("utf-8"))
 
-    _state.projects.clear()
+
+class VersionResult:
+    """
+    The outcome of resolving a project's version.
+
+    :ivar name: Project name from pyproject.toml.
+    :ivar version: Serialized version, as the plugin would apply it.
+    :ivar instance: Dunamai `Version` that the serialized version was produced from.
+    :ivar pyproject_path: Path to the project's pyproject.toml.
+    :ivar files: Files whose content would change during substitution.
+    :ivar timings: Seconds spent on each step (`config`, `vcs`, `files`, and `total`).
+    :ivar formats: Version serialized with each entry of the `formats` setting, by name.
+    """
+
+    def __init__(
+        self,
+        session: "Session",
+        name: str,
+        version: str,
+        instance: "Version",
+        pyproject_path: Path,
+        files: Sequence[Path],
+        timings: Mapping[str, float],
+        overrides: Optional[Mapping] = None,
+        formats: Optional[Mapping[str, str]] = None,
+    ) -> None:
+        self._session = session
+        self.name = name
+        self.version = version
+        self.instance = instance
+        self.pyproject_path = pyproject_path
+        self.files = files
+        self.timings = timings
+        self.formats = formats if formats is not None else {}
+        self._overrides = overrides
+
+    def __repr__(self) -> str:
+        return "VersionResult(name={!r}, version={!r})".format(self.name, self.version)
+
+    @contextmanager
+    def applied(self) -> Iterator["VersionResult"]:
+        """
+        Apply the version to the project's files, then revert the changes afterwards.
+        """
+        self._session.apply(self)
+        try:
+            yield self
+        finally:
+            self._session.revert(self)
+
+
+class Session:
+    """
+    Resolve and apply versions for any number of projects in the current process.
+
+    Each session tracks the changes that it has applied independently of the plugin,
+    so separate sessions can be used from different threads.
+    A session can also be used as a context manager,
+    in which case any changes that it applied are reverted at the end.
+    """
+
+    def __init__(self) -> None:
+        self._state = _State()
+        # Like the CLI, we change the source files directly and leave the `enable` setting alone.
+        self._state.cli_mode = True
+
+    def __enter__(self) -> "Session":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.revert()
+
+    def get_version(self, path: Union[str, Path] = ".", config: Optional[Mapping] = None) -> VersionResult:
+        """
+        Resolve a project's version without modifying any files.
+
+        :param path: Project directory or pyproject.toml file (or any path below the project).
+        :param config: Settings to use on top of the project's
+            `tool.poetry-dynamic-versioning` table, using the same keys.
+            The plugin's `enable` setting is not required.
+        :returns: The resolved version.
+        """
+        import tomlkit
+
+        started = time.perf_counter()
+
+        path = Path(path)
+        pyproject_path = path if path.is_file() else _get_pyproject_path(path)
+        if pyproject_path is None:
+            raise RuntimeError("Unable to find pyproject.toml")
+        pyproject = tomlkit.parse(pyproject_path.read_bytes().decode("utf-8")).unwrap()
+
+        name = pyproject.get("tool", {}).get("poetry", {}).get("name")
+        if name is None:
+            name = pyproject.get("project", {}).get("name")
+        if name is None:
+            raise RuntimeError("Unable to determine project name from {}".format(pyproject_path))
+
+        resolved_config = _get_config(pyproject, config, pyproject_path)
+        loaded = time.perf_counter()
+
+        version, instance = _get_version(resolved_config, name, pyproject_path.parent)
+        formats = _serialize_formats(instance, resolved_config)
+        queried = time.perf_counter()
+
+        files = []
+        folders = _FolderConfig.from_config(resolved_config, pyproject_path.parent)
+        for file, folder in _find_substitution_files(folders).items():
+            content = file.read_bytes().decode("utf-8")
+            if _substitute_version_in_text(version, content, folder.patterns) != content:
+                files.append(file)
+        finished = time.perf_counter()
+
+        timings = {
+            "config": loaded - started,
+            "vcs": queried - loaded,
+            "files": finished - queried,
+            "total": finished - started,
+        }
+        return VersionResult(self, name, version, instance, pyproject_path, files, timings, config, formats)
+
+    def apply(self, result: VersionResult) -> None:
+        """
+        Apply a resolved version to the project's files.
+        The changes remain until you call `revert()`.
+
+        :param result: Output of `get_version()` from this session.
+        """
+        with self._state.lock:
+            self._state.resolutions[str(result.pyproject_path.resolve())] = {
+                "version": result.version,
+                "instance": _version_to_dict(result.instance),
+            }
+        _get_and_apply_version(result.pyproject_path, force=True, session=self._state, overrides=result._overrides)
+
+    def revert(self, result: Optional[VersionResult] = None) -> None:
+        """
+        Undo changes made by `apply()`.
+
+        :param result: Only revert this project. By default, revert all projects in this session.
+        """
+        _revert_version(session=self._state, names=None if result is None else [result.name])
+
+
+def get_version(path: Union[str, Path] = ".", config: Optional[Mapping] = None) -> VersionResult:
+    """
+    Resolve a project's version without modifying any files.
+    This is a shortcut for `Session().get_version()`.
+
+    :param path: Project directory or pyproject.toml file (or any path below the project).
+    :param config: Settings to use on top of the project's
+        `tool.poetry-dynamic-versioning` table, using the same keys.
+    :returns: The resolved version.
+    """
+    return Session().get_version(path, config)
@@ -16,7 +16,19 @@ def main() -> None:
         elif args.cmd == cli.Command.enable:
             cli.enable()
         elif args.cmd == cli.Command.show:
-            cli.show()
+            cli.show(args.formats, args.output)
+        elif args.cmd == cli.Command.serve:
+            cli.serve(args.socket)
+        elif args.cmd == cli.Command.history:
+            cli.history(args.revision)
+        elif args.cmd == cli.Command.export:
+            cli.export(args.output)
+        elif args.cmd == cli.Command.watch:
+            cli.watch(args.interval)
+        elif args.cmd == cli.Command.install_hooks:
+            cli.install_hooks()
+        elif args.cmd == cli.Command.refresh_cache:
+            cli.refresh_cache()
     except Exception as e:
         print("Error: {}".format(e), file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,152 @@
+# This module isn't meant to be imported.
+# `_render_version_shim` appends everything below the marker
+# to the version module for `files.*.version-module = "editable"`, to refresh it at import time.
+# It must only rely on the standard library, since the plugin is usually installed separately from the project.
+# It also mustn't contain any absolute paths, since the module ends up in the built artifacts too,
+# so it finds the repository and the cache file the same way as `_find_git_dirs` and `_get_version_cache_file`.
+from __future__ import annotations
+
+# The version module defines these before the shim.
+__version__: str
+__version_tuple__: tuple[int | str, ...]
+__commit__: str | None
+__distance__: int
+
+# --- shim ---
+import os as _os
+
+# The module's path relative to the project root, and the commit that the values above are for.
+# `_render_version_shim` fills these in.
+_PATH = ""
+_HEAD = ""
+
+
+def _find_root() -> str | None:
+    root = _os.path.dirname(_os.path.abspath(__file__))
+    for _ in range(_PATH.count("/")):
+        root = _os.path.dirname(root)
+    # When the package is installed normally, there's no project around it.
+    if not _os.path.isfile(_os.path.join(root, "pyproject.toml")):
+        return None
+    return root
+
+
+def _read_head(root: str) -> str | None:
+    level = root
+    while True:
+        dot_git = _os.path.join(level, ".git")
+        if _os.path.isdir(dot_git):
+            git_dir = dot_git
+            break
+        elif _os.path.isfile(dot_git):
+            with open(dot_git) as f:
+                content = f.read().strip()
+            if not content.startswith("gitdir:"):
+                return None
+            git_dir = _os.path.join(level, content[len("gitdir:") :].strip())
+            break
+        parent = _os.path.dirname(level)
+        if parent == level:
+            return None
+        level = parent
+
+    common_dir = git_dir
+    if _os.path.isfile(_os.path.join(git_dir, "commondir")):
+        with open(_os.path.join(git_dir, "commondir")) as f:
+            common_dir = _os.path.join(git_dir, f.read().strip())
+
+    with open(_os.path.join(git_dir, "HEAD")) as f:
+        head = f.read().strip()
+    if not head.startswith("ref: "):
+        return head
+    ref = head[len("ref: ") :]
+    try:
+        with open(_os.path.join(common_dir, ref)) as f:
+            return f.read().strip()
+    except OSError:
+        with open(_os.path.join(common_dir, "packed-refs")) as f:
+            for line in f:
+                if line.rstrip().endswith(" " + ref):
+                    return line.split(" ", 1)[0]
+    return None
+
+
+def _read_cache(root: str, head: str) -> dict | None:
+    import hashlib
+    import json
+    import sys
+
+    cache_dir = _os.environ.get("POETRY_DYNAMIC_VERSIONING_CACHE_DIR")
+    if not cache_dir:
+        if sys.platform == "win32":
+            base = _os.environ.get("LOCALAPPDATA") or _os.path.join(_os.path.expanduser("~"), "AppData", "Local")
+        else:
+            base = _os.environ.get("XDG_CACHE_HOME") or _os.path.join(_os.path.expanduser("~"), ".cache")
+        cache_dir = _os.path.join(base, "poetry-dynamic-versioning")
+    digest = hashlib.sha256(_os.path.realpath(root).encode("utf-8")).hexdigest()[:16]
+
+    try:
+        with open(_os.path.join(cache_dir, "versions", digest + ".json"), "rb") as f:
+            entry = json.loads(f.read().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+    return entry if entry.get("head") == head and entry.get("serialized") else None
+
+
+def _refresh_cache(root: str) -> None:
+    import shutil
+    import subprocess
+
+    # The script may live in a separate environment from the project, like Poetry's own.
+    executable = shutil.which("poetry-dynamic-versioning")
+    if executable is None:
+        return
+    try:
+        subprocess.run(
+            [executable, "refresh-cache"],
+            cwd=root,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=30,
+        )
+    except (OSError, subprocess.SubprocessError):
+        pass
+
+
+def _refresh() -> None:
+    global __version__, __version_tuple__, __commit__, __distance__
+
+    root = _find_root()
+    if root is None:
+        return
+    try:
+        head = _read_head(root)
+    except OSError:
+        return
+    if head is None or head == _HEAD:
+        return
+
+    # The Git hooks from `poetry-dynamic-versioning install-hooks` keep the cache up to date.
+    # Without them, we resolve the version for the new commit now.
+    # If that doesn't work either, we keep the values above until the version is applied again.
+    entry = _read_cache(root, head)
+    if entry is None:
+        _refresh_cache(root)
+        entry = _read_cache(root, head)
+    if entry is None:
+        return
+
+    import re
+
+    __version__ = entry["serialized"]
+    split = __version__.split("+", 1)
+    __version_tuple__ = tuple(
+        int(x) if x.isdigit() else x for x in [*re.split(r"[-.]", split[0]), *split[1:]] if x != ""
+    )
+    __commit__ = entry["version"]["commit"]
+    __distance__ = entry["version"]["distance"]
+
+
+# Until `_render_version_shim` fills in the commit, there's nothing to compare against.
+if _HEAD:
+    _refresh()
@@ -0,0 +1,186 @@
+import os
+import struct
+from io import BytesIO, StringIO
+from pathlib import Path
+from typing import Mapping, MutableMapping, Optional, Sequence, Tuple, TYPE_CHECKING  # noqa: F401
+
+from poetry_dynamic_versioning import (
+    _debug,
+    _find_substitution_files,
+    _FolderConfig,
+    _get_config,
+    _get_session,
+    _get_substitution_target,
+    _set_version_in_pyproject,
+    _State,
+    _substitute_version_in_text,
+    _Target,
+)
+
+if TYPE_CHECKING:
+    import zipfile
+
+
+def _hash_record_entry(content: bytes) -> str:
+    import base64
+    import hashlib
+
+    digest = base64.urlsafe_b64encode(hashlib.sha256(content).digest()).rstrip(b"=").decode("ascii")
+    return "sha256={}".format(digest)
+
+
+def _clone_zip_info(info: "zipfile.ZipInfo") -> "zipfile.ZipInfo":
+    import zipfile
+
+    clone = zipfile.ZipInfo(info.filename, info.date_time)
+    clone.compress_type = info.compress_type
+    clone.create_system = info.create_system
+    clone.external_attr = info.external_attr
+    clone.file_size = info.file_size
+    return clone
+
+
+def _copy_zip_member(source: "zipfile.ZipFile", target: "zipfile.ZipFile", info: "zipfile.ZipInfo") -> None:
+    import shutil
+
+    # Streaming keeps large members out of memory,
+    # and the known size lets `zipfile` decide whether the member needs ZIP64 extensions.
+    with source.open(info) as reader, target.open(_clone_zip_info(info), "w") as writer:
+        shutil.copyfileobj(reader, writer)
+
+
+def _substitute_version_in_wheel(path: Path, replacements: Mapping[str, Tuple[bytes, bytes]]) -> bool:
+    import csv
+    import zipfile
+
+    with zipfile.ZipFile(str(path)) as source:
+        changes = {}  # type: MutableMapping[str, bytes]
+        record = None
+
+        for info in source.infolist():
+            if info.filename.endswith(".dist-info/RECORD"):
+                record = info
+                continue
+
+            # Wheel paths are relative to the package's source folder (e.g., `src`),
+            # so we match on the path suffix and confirm with the original content.
+            candidates = [x for x in replacements if x == info.filename or x.endswith("/{}".format(info.filename))]
+            if not candidates:
+                continue
+
+            content = source.read(info)
+            for candidate in candidates:
+                original, new = replacements[candidate]
+                if content == original:
+                    changes[info.filename] = new
+                    break
+
+        if not changes:
+            _debug("No changes made during substitution in artifact '{}'".format(path))
+            return False
+
+        temp = path.with_name(path.name + ".tmp")
+        with zipfile.ZipFile(str(temp), "w") as target:
+            for info in source.infolist():
+                if info is record:
+                    continue
+                elif info.filename in changes:
+                    target.writestr(_clone_zip_info(info), changes[info.filename])
+                else:
+                    _copy_zip_member(source, target, info)
+
+            if record is not None:
+                output = StringIO()
+                writer = csv.writer(output, lineterminator="\n")
+                for row in csv.reader(StringIO(source.read(record).decode("utf-8"))):
+                    if row and row[0] in changes:
+                        content = changes[row[0]]
+                        row = [row[0], _hash_record_entry(content), str(len(content))]
+                    writer.writerow(row)
+                target.writestr(_clone_zip_info(record), output.getvalue())
+
+    os.replace(str(temp), str(path))
+    return True
+
+
+def _substitute_version_in_sdist(
+    path: Path, replacements: Mapping[str, Tuple[bytes, bytes]], pyproject: Optional[bytes] = None
+) -> bool:
+    import tarfile
+    from gzip import GzipFile
+
+    with path.open("rb") as f:
+        # Preserve the gzip timestamp for reproducible builds.
+        mtime = struct.unpack("<I", f.read(8)[4:8])[0]
+
+    temp = path.with_name(path.name + ".tmp")
+    changed = False
+
+    with tarfile.open(str(path), "r|gz") as source, GzipFile(str(temp), mode="wb", mtime=mtime) as gz:
+        with tarfile.TarFile(str(temp), mode="w", fileobj=gz, format=tarfile.PAX_FORMAT) as target:
+            for info in source:
+                data = source.extractfile(info) if info.isfile() else None
+                if data is None:
+                    target.addfile(info)
+                    continue
+
+                # Everything in an sdist is nested under a `{name}-{version}` folder.
+                relative = info.name.split("/", 1)[-1]
+                new = None
+                if relative == "pyproject.toml" and pyproject is not None:
+                    new = pyproject
+                elif relative in replacements:
+                    original, substituted = replacements[relative]
+                    content = data.read()
+                    new = substituted if content == original else content
+
+                if new is None:
+                    target.addfile(info, data)
+                else:
+                    changed = True
+                    info.size = len(new)
+                    target.addfile(info, BytesIO(new))
+
+    if not changed:
+        temp.unlink()
+        _debug("No changes made during substitution in artifact '{}'".format(path))
+        return False
+
+    os.replace(str(temp), str(path))
+    return True
+
+
+def _substitute_version_in_artifacts(name: str, artifacts: Sequence[Path], session: Optional[_State] = None) -> None:
+    import tomlkit
+
+    session = _get_session(session)
+    with session.lock:
+        state = session.projects[name]
+    pyproject = tomlkit.parse(state.path.read_bytes().decode("utf-8"))
+    config = _get_config(pyproject, pyproject_path=state.path)
+
+    if _get_substitution_target(config, session=session) != _Target.Artifacts:
+        return
+
+    root = state.path.parent.resolve()
+    replacements = {}  # type: MutableMapping[str, Tuple[bytes, bytes]]
+    for file, folder in _find_substitution_files(_FolderConfig.from_config(config, state.path.parent)).items():
+        try:
+            relative = file.relative_to(root).as_posix()
+        except ValueError:
+            continue
+        original = file.read_bytes()
+        new = _substitute_version_in_text(state.version, original.decode("utf-8"), folder.patterns).encode("utf-8")
+        if original != new:
+            replacements[relative] = (original, new)
+
+    # The sdist needs the same static version and disabled plugin
+    # that we would otherwise write to the source tree.
+    _set_version_in_pyproject(pyproject, state.version, state.mode, disable=True)
+    pyproject_content = tomlkit.dumps(pyproject).encode("utf-8")
+
+    for artifact in artifacts:
+        if artifact.name.endswith(".whl"):
+            _substitute_version_in_wheel(artifact, replacements)
+        elif artifact.name.endswith(".tar.gz"):
+            _substitute_version_in_sdist(artifact, replacements, pyproject_content)
@@ -1,5 +1,59 @@
 # flake8: noqa
+from pathlib import Path
+
+from poetry.core.masonry import api as _api
 from poetry.core.masonry.api import *
 import poetry_dynamic_versioning.patch as patch
 
 patch.activate()
+
+# Frontends like Pip call each hook in a separate process,
+# so we pass the resolved version along via the metadata directory.
+# The build hooks receive the `.dist-info` folder inside of that directory.
+#
+# With `--config-settings dynamic-versioning=combined`,
+# `build_sdist` also leaves the version applied for the following `build_wheel`,
+# which then reverts it once both artifacts are built.
+
+
+def prepare_metadata_for_build_wheel(metadata_directory, config_settings=None):  # type: ignore
+    name = _api.prepare_metadata_for_build_wheel(metadata_directory, config_settings)
+    patch.save_resolutions(Path(metadata_directory))
+    return name
+
+
+def prepare_metadata_for_build_editable(metadata_directory, config_settings=None):  # type: ignore
+    name = _api.prepare_metadata_for_build_editable(metadata_directory, config_settings)
+    patch.save_resolutions(Path(metadata_directory))
+    return name
+
+
+def build_wheel(wheel_directory, config_settings=None, metadata_directory=None):  # type: ignore
+    if metadata_directory is not None:
+        patch.load_resolutions(Path(metadata_directory).parent)
+    if patch.is_combined_build(config_settings):
+        patch.resume_applied()
+    try:
+        name = _api.build_wheel(wheel_directory, config_settings, metadata_directory)
+        patch.substitute_artifact(Path(wheel_directory) / name)
+    finally:
+        if patch.is_combined_build(config_settings):
+            patch.finish_applied()
+    return name
+
+
+def build_editable(wheel_directory, config_settings=None, metadata_directory=None):  # type: ignore
+    if metadata_directory is not None:
+        patch.load_resolutions(Path(metadata_directory).parent)
+    return _api.build_editable(wheel_directory, config_settings, metadata_directory)
+
+
+def build_sdist(sdist_directory, config_settings=None):  # type: ignore
+    if patch.is_combined_build(config_settings):
+        # Anything left over is from an earlier build that didn't finish.
+        patch.discard_applied()
+    name = _api.build_sdist(sdist_directory, config_settings)
+    patch.substitute_artifact(Path(sdist_directory) / name)
+    if patch.is_combined_build(config_settings):
+        patch.keep_applied()
+    return name
@@ -0,0 +1,206 @@
+import json
+import os
+import shlex
+from pathlib import Path
+from typing import Mapping, Optional, Sequence, TYPE_CHECKING
+
+from poetry_dynamic_versioning import (
+    _acquire_lock,
+    _Config,
+    _debug,
+    _get_git_branch,
+    _get_version_cache_file,
+    _get_version_from_dunamai,
+    _is_git_dirty,
+    _needs_dirty,
+    _parse_git_timestamp,
+    _release_lock,
+    _run_cmd,
+    _serialize_version,
+    _vcs_fingerprint,
+    _version_from_dict,
+    _version_to_dict,
+)
+
+if TYPE_CHECKING:
+    from dunamai import Version
+
+# Settings that affect the Dunamai `Version`, as opposed to how it's serialized.
+_VERSION_CACHE_SETTINGS = [
+    "vcs",
+    "pattern",
+    "pattern-prefix",
+    "latest-tag",
+    "highest-tag",
+    "tag-dir",
+    "tag-branch",
+    "full-commit",
+    "commit-length",
+    "ignore-untracked",
+    "max-tag-search-depth",
+    "fallback-base",
+]
+
+
+def _get_version_cache_key(config: _Config) -> str:
+    return json.dumps({x: config[x] for x in _VERSION_CACHE_SETTINGS}, sort_keys=True)  # type: ignore
+
+
+def _get_anchor_fingerprint(fingerprint: Sequence[Sequence]) -> Sequence[Sequence]:
+    # These are the parts that can change which tag is selected, other than new commits.
+    refs_tags = os.path.join("refs", "tags")
+    return [x for x in fingerprint if refs_tags in x[0] or x[0].endswith(("packed-refs", "shallow"))]
+
+
+def _get_version_from_cache(config: _Config, strict: bool, path: Optional[Path]) -> Optional["Version"]:
+    """
+    Use the version that the Git hooks from `poetry-dynamic-versioning install-hooks` stored,
+    if it's still current.
+    """
+    from dunamai import Concern
+
+    file = _get_version_cache_file(path)
+    if not file.exists():
+        return None
+
+    try:
+        entry = json.loads(file.read_bytes().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+
+    fingerprint = _vcs_fingerprint(Path.cwd() if path is None else path)
+    if fingerprint is None or entry.get("fingerprint") != [list(x) for x in fingerprint]:
+        return None
+    if entry.get("config") != _get_version_cache_key(config):
+        return None
+    if strict and entry["concerns"]:
+        return None
+
+    version = _version_from_dict(entry["version"])
+    version.concerns = {Concern(x) for x in entry["concerns"]}
+    if _needs_dirty(config):
+        # The hooks only run when refs change, so they can't know about the working tree.
+        dirty = _is_git_dirty(path, config["ignore-untracked"])
+        if dirty is None:
+            return None
+        version.dirty = dirty
+    _debug("Using cached version for '{}'".format(Path.cwd() if path is None else path))
+    return version
+
+
+def _extend_cached_version(entry: Mapping, config: _Config, path: Path) -> Optional["Version"]:
+    """
+    Update a cached version for new commits on top of the cached one,
+    as long as none of them are merges or tagged,
+    since the selected tag stays the same in that case and only the distance grows.
+    """
+    head = entry["head"]
+    if head is None:
+        return None
+    if config["tag-branch"] is not None and _get_tag_branch_commit(config, path) != entry.get("tag-branch"):
+        # The tags are selected from that branch's history, so it must not have moved either.
+        return None
+    code, msg = _run_cmd(
+        'git -c log.showsignature=false log --decorate-refs=refs/tags --format="%H%x00%h%x00%cI%x00%P%x00%D"'
+        " {}..HEAD".format(head),
+        codes=[],
+        path=path,
+    )
+    if code != 0:
+        return None
+
+    commits = [line.split("\x00") for line in msg.splitlines()]
+    if not commits:
+        _, current = _run_cmd("git rev-parse HEAD", path=path)
+        if current != head:
+            # HEAD moved back to an older commit.
+            return None
+    for i, (oid, short_oid, timestamp, parents, tags) in enumerate(commits):
+        expected = commits[i + 1][0] if i + 1 < len(commits) else head
+        if parents != expected or tags:
+            return None
+
+    version = _version_from_dict(entry["version"])
+    version.branch = _get_git_branch(path)
+    if commits:
+        oid, short_oid, timestamp = commits[0][:3]
+        full_commit = config["full-commit"] or config["commit-length"] is not None
+        version.commit = (oid if full_commit else short_oid)[: config["commit-length"]]
+        version.distance += len(commits)
+        version.timestamp = _parse_git_timestamp(timestamp)
+    return version
+
+
+def _get_tag_branch_commit(config: _Config, path: Path) -> Optional[str]:
+    if config["tag-branch"] is None:
+        return None
+    code, msg = _run_cmd(
+        "git rev-parse --verify -q {}".format(shlex.quote("{}^{{commit}}".format(config["tag-branch"]))),
+        codes=[0, 1],
+        path=path,
+    )
+    return msg if code == 0 else None
+
+
+def _refresh_version_cache(config: _Config, path: Path) -> Optional["Version"]:
+    """
+    Store the current version for `_get_version_from_cache`.
+    When the cached version is only missing some new commits, it's updated incrementally,
+    instead of resolving the version again from scratch.
+    """
+    from dunamai import Pattern, Vcs
+
+    fingerprint = _vcs_fingerprint(path)
+    if fingerprint is None:
+        return None
+    serialized_fingerprint = [list(x) for x in fingerprint]
+
+    file = _get_version_cache_file(path)
+    handle = _acquire_lock(file.with_suffix(".lock"))
+    if handle is None:
+        return None
+
+    try:
+        try:
+            entry = json.loads(file.read_bytes().decode("utf-8"))  # type: Optional[Mapping]
+        except (OSError, ValueError):
+            entry = None
+
+        key = _get_version_cache_key(config)
+        anchors = _get_anchor_fingerprint(serialized_fingerprint)
+
+        version = None
+        if entry is not None and entry["config"] == key:
+            if entry["fingerprint"] == serialized_fingerprint:
+                version = _version_from_dict(entry["version"])
+                if entry.get("serialized") == _serialize_version(version, config):
+                    return version
+            elif entry["anchors"] == anchors and not entry["concerns"]:
+                version = _extend_cached_version(entry, config, path)
+                if version is not None:
+                    _debug("Extended cached version for '{}'".format(path))
+
+        if version is None:
+            pattern = config["pattern"] if config["pattern"] is not None else Pattern.Default
+            version = _get_version_from_dunamai(
+                Vcs(config["vcs"]), pattern, config, strict=False, path=path, cache=False
+            )
+
+        code, head = _run_cmd("git rev-parse --verify -q HEAD", codes=[0, 1], path=path)
+        content = {
+            "fingerprint": serialized_fingerprint,
+            "anchors": anchors,
+            "config": key,
+            "head": head if code == 0 else None,
+            "tag-branch": _get_tag_branch_commit(config, path),
+            "version": _version_to_dict(version),
+            "concerns": sorted(x.value for x in version.concerns),
+            # For the version modules from `files.*.version-module = "editable"`.
+            "serialized": _serialize_version(version, config),
+        }
+        temporary = file.with_suffix(".tmp")
+        temporary.write_bytes(json.dumps(content).encode("utf-8"))
+        os.replace(str(temporary), str(file))
+        return version
+    finally:
+        _release_lock(handle)
@@ -1,24 +1,46 @@
 import argparse
+import re
 import sys
+from pathlib import Path
 from typing import (
+    Any,  # noqa: F401
+    Dict,  # noqa: F401
     Mapping,
     Optional,
+    Sequence,
+    TYPE_CHECKING,
 )
 
-import tomlkit
-
 from poetry_dynamic_versioning import (
     _get_and_apply_version,
     _get_config,
+    _get_file_fingerprint,
     _get_override_version,
     _get_pyproject_path,
+    _get_server_socket,
     _get_version,
+    _get_workspace_projects,
+    _OVERRIDE_ENV,
+    _revert_version,
+    _run_cmd,
+    _serialize_formats,
+    _serialize_version,
     _state,
+    _State,
     _validate_config,
+    _vcs_fingerprint,
 )
+from poetry_dynamic_versioning.cache import _refresh_version_cache
+from poetry_dynamic_versioning.history import _get_version_history
+
+if TYPE_CHECKING:
+    import tomlkit
 
 _DEFAULT_REQUIRES = ["poetry-core>=1.0.0", "poetry-dynamic-versioning>=1.0.0,<2.0.0"]
 _DEFAULT_BUILD_BACKEND = "poetry_dynamic_versioning.backend"
+_DEFAULT_FORMAT = "default"
+_HOOK_MARKER = "# Installed by poetry-dynamic-versioning to refresh the cached version."
+_HOOKS = ["post-commit", "post-checkout", "post-merge", "reference-transaction"]
 
 
 class Key:
@@ -39,6 +61,12 @@ class Command:
     dv = "dynamic-versioning"
     enable = "enable"
     show = "show"
+    serve = "serve"
+    history = "history"
+    export = "export"
+    watch = "watch"
+    install_hooks = "install-hooks"
+    refresh_cache = "refresh-cache"
     dv_enable = "{} {}".format(dv, enable)
     dv_show = "{} {}".format(dv, show)
 
@@ -54,6 +82,46 @@ class Help:
         " The output may not be suitable for more complex use cases."
     )
     show = "Print the version without changing any files."
+    show_format = (
+        "Print the version with this entry from the `formats` setting."
+        " Use `default` for the main version. This may be repeated."
+        " Default: only the main version for text output, or all formats for JSON and env output."
+    )
+    show_output = (
+        "How to print the versions."
+        " `text` prints one version per line,"
+        " `json` prints an object with `version` and `formats` keys,"
+        " and `env` prints `VERSION` and `VERSION_<NAME>` assignments. Default: text."
+    )
+    serve = (
+        "Run a background server that caches VCS results for repeated builds on this machine."
+        " Other processes use it automatically while it is running."
+    )
+    serve_socket = "Path of the Unix socket to listen on. Default: server.sock in the cache directory."
+    history = (
+        "Print the version of every commit reachable from a revision, oldest first, as JSON lines."
+        " This does not check out any commits."
+    )
+    history_revision = "Revision whose history to walk. Default: HEAD."
+    export = (
+        "Print the versions of this project and its path dependencies that use the plugin,"
+        " so that later builds can use them without querying the VCS."
+    )
+    watch = (
+        "Keep applying the dynamic version to all relevant files, like the default mode,"
+        " whenever the Git HEAD, refs, or pyproject.toml change."
+    )
+    watch_interval = "Seconds between checks for changes. Default: 1."
+    install_hooks = (
+        "Install Git hooks that refresh a cached version in the background whenever commits or refs change,"
+        " so that builds can use it without querying Git."
+    )
+    refresh_cache = "Update the cached version used with install-hooks."
+    export_output = (
+        "Manifest format."
+        " `json` is for the POETRY_DYNAMIC_VERSIONING_MANIFEST environment variable,"
+        " and `env` is a POETRY_DYNAMIC_VERSIONING_OVERRIDE assignment for an env file. Default: json."
+    )
 
 
 def get_parser() -> argparse.ArgumentParser:
@@ -61,7 +129,19 @@ def get_parser() -> argparse.ArgumentParser:
 
     subparsers = parser.add_subparsers(dest="cmd", title="subcommands")
     subparsers.add_parser(Command.enable, help=Help.enable)
-    subparsers.add_parser(Command.show, help=Help.show)
+    show_parser = subparsers.add_parser(Command.show, help=Help.show)
+    show_parser.add_argument("--format", action="append", dest="formats", metavar="NAME", help=Help.show_format)
+    show_parser.add_argument("--output", choices=["text", "json", "env"], default="text", help=Help.show_output)
+    serve_parser = subparsers.add_parser(Command.serve, help=Help.serve)
+    serve_parser.add_argument("--socket", type=Path, help=Help.serve_socket)
+    history_parser = subparsers.add_parser(Command.history, help=Help.history)
+    history_parser.add_argument("revision", nargs="?", default="HEAD", help=Help.history_revision)
+    export_parser = subparsers.add_parser(Command.export, help=Help.export)
+    export_parser.add_argument("--output", choices=["json", "env"], default="json", help=Help.export_output)
+    watch_parser = subparsers.add_parser(Command.watch, help=Help.watch)
+    watch_parser.add_argument("--interval", type=float, default=1.0, help=Help.watch_interval)
+    subparsers.add_parser(Command.install_hooks, help=Help.install_hooks)
+    subparsers.add_parser(Command.refresh_cache, help=Help.refresh_cache)
 
     return parser
 
@@ -103,6 +183,8 @@ def report_apply(name: str) -> None:
 
 
 def enable() -> None:
+    import tomlkit
+
     pyproject_path = _get_pyproject_path()
     if pyproject_path is None:
         raise RuntimeError("Unable to find pyproject.toml")
@@ -112,7 +194,9 @@ def enable() -> None:
     pyproject_path.write_bytes(tomlkit.dumps(config).encode("utf-8"))
 
 
-def _enable_in_doc(doc: tomlkit.TOMLDocument, env: Optional[Mapping] = None) -> tomlkit.TOMLDocument:
+def _enable_in_doc(doc: "tomlkit.TOMLDocument", env: Optional[Mapping] = None) -> "tomlkit.TOMLDocument":
+    import tomlkit
+
     name = doc.get(Key.project, {}).get(Key.name) or doc.get(Key.tool, {}).get(Key.poetry, {}).get(Key.name)
     placeholder_version = _get_override_version(name, env) or "0.0.0"
 
@@ -153,13 +237,216 @@ def _enable_in_doc(doc: tomlkit.TOMLDocument, env: Optional[Mapping] = None) ->
     return doc
 
 
-def show() -> None:
+def show(formats: Optional[Sequence[str]] = None, output: str = "text") -> None:
+    import tomlkit
+
     pyproject_path = _get_pyproject_path()
     if pyproject_path is None:
         raise RuntimeError("Unable to find pyproject.toml")
 
     pyproject = tomlkit.parse(pyproject_path.read_bytes().decode("utf-8"))
-    config = _get_config(pyproject)
+    config = _get_config(pyproject, pyproject_path=pyproject_path)
     version = _get_version(config)
 
-    print(version[0])
+    if formats is None and output == "text":
+        print(version[0])
+        return
+
+    rendered = _serialize_formats(version[1], config)
+    if formats is not None:
+        unknown = [x for x in formats if x != _DEFAULT_FORMAT and x not in rendered]
+        if unknown:
+            raise RuntimeError("Unknown format: {}".format(", ".join(unknown)))
+        main = version[0] if _DEFAULT_FORMAT in formats else None
+        rendered = {x: rendered[x] for x in formats if x != _DEFAULT_FORMAT}
+    else:
+        main = version[0]
+
+    print(_format_versions(main, rendered, output))
+
+
+def _format_versions(version: Optional[str], formats: Mapping[str, str], output: str) -> str:
+    import json
+
+    if output == "json":
+        data = {"formats": formats}  # type: Dict[str, Any]
+        if version is not None:
+            data["version"] = version
+        return json.dumps(data, sort_keys=True)
+
+    if output == "env":
+        lines = [] if version is None else ["VERSION={}".format(version)]
+        for name, value in formats.items():
+            lines.append("VERSION_{}={}".format(re.sub(r"[^A-Z0-9]", "_", name.upper()), value))
+        return "\n".join(lines)
+
+    return "\n".join([*([] if version is None else [version]), *formats.values()])
+
+
+def history(revision: str = "HEAD") -> None:
+    import json
+
+    import tomlkit
+
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None:
+        raise RuntimeError("Unable to find pyproject.toml")
+
+    pyproject = tomlkit.parse(pyproject_path.read_bytes().decode("utf-8"))
+    config = _get_config(pyproject, pyproject_path=pyproject_path)
+    for entry in _get_version_history(config, pyproject_path.parent, revision):
+        print(json.dumps(entry), flush=True)
+
+
+def export(output: str = "json") -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from poetry_dynamic_versioning import Session
+
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None:
+        raise RuntimeError("Unable to find pyproject.toml")
+
+    session = Session()
+    with ThreadPoolExecutor(thread_name_prefix="poetry-dynamic-versioning") as executor:
+        results = list(executor.map(session.get_version, _get_workspace_projects(pyproject_path)))
+
+    print(_format_manifest({x.name: x.version for x in results}, output))
+
+
+def _format_manifest(versions: Mapping[str, str], output: str) -> str:
+    import json
+
+    if output == "env":
+        return "{}={}".format(_OVERRIDE_ENV, ",".join("{}={}".format(k, v) for k, v in sorted(versions.items())))
+
+    return json.dumps({"versions": versions}, indent=2, sort_keys=True)
+
+
+def watch(interval: float = 1.0) -> None:
+    import time
+
+    validate(standalone=True)
+
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None:
+        raise RuntimeError("Unable to find pyproject.toml")
+    if _vcs_fingerprint(pyproject_path.parent) is None:
+        raise RuntimeError("Watch mode is only available for Git repositories")
+
+    def fingerprint() -> tuple:
+        # This only looks at a few files in the Git directory, never the working tree.
+        return (_vcs_fingerprint(pyproject_path.parent), _get_file_fingerprint(pyproject_path))
+
+    seen = None
+    version = None
+    previous = None  # type: Optional[_State]
+    try:
+        while True:
+            current = fingerprint()
+            if current != seen:
+                if previous is not None:
+                    # Restore the dynamic version settings in pyproject.toml so that we can apply it again,
+                    # but leave the substituted files alone, since the next round updates them in place.
+                    for state in previous.projects.values():
+                        state.substitutions.clear()
+                    _revert_version(retain=True, session=previous)
+
+                # Each round gets a fresh session, which leaves its changes in place.
+                session = _State()
+                session.cli_mode = True
+                previous = session
+                try:
+                    name = _get_and_apply_version(pyproject_path, retain=True, force=True, session=session)
+                    if not name:
+                        raise RuntimeError("Unable to determine a dynamic version")
+                except Exception as e:
+                    print("Error: {}".format(e), file=sys.stderr)
+                else:
+                    state = session.projects[name]
+                    if state.version != version:
+                        version = state.version
+                        print("Version: {}".format(version), file=sys.stderr)
+                    for file_name in state.substitutions:
+                        print("  - Updated {}".format(file_name), file=sys.stderr)
+                # Applying the version may have changed pyproject.toml.
+                seen = fingerprint()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def install_hooks() -> None:
+    import shlex
+    import shutil
+
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None:
+        raise RuntimeError("Unable to find pyproject.toml")
+    project = pyproject_path.parent.resolve()
+
+    executable = shutil.which("poetry-dynamic-versioning")
+    if executable is None:
+        raise RuntimeError("Unable to find the poetry-dynamic-versioning script on the PATH")
+
+    _, hooks_path = _run_cmd("git rev-parse --git-path hooks", path=project)
+    hooks = project / hooks_path
+    hooks.mkdir(parents=True, exist_ok=True)
+
+    # Git waits for hooks to finish, so the work happens in the background.
+    line = "(cd {} && exec {} {}) >/dev/null 2>&1 &".format(
+        shlex.quote(str(project)), shlex.quote(executable), Command.refresh_cache
+    )
+    # Check everything first so that we don't leave the hooks half installed.
+    for hook in _HOOKS:
+        _check_hook(hooks / hook)
+    for hook in _HOOKS:
+        _add_hook_line(hooks / hook, hook, line)
+        print("Installed {}".format(hooks / hook), file=sys.stderr)
+
+    refresh_cache()
+
+
+def _check_hook(file: Path) -> None:
+    if file.exists() and _HOOK_MARKER not in file.read_bytes().decode("utf-8"):
+        raise RuntimeError("Not replacing existing hook that wasn't installed by this tool: {}".format(file))
+
+
+def _add_hook_line(file: Path, hook: str, line: str) -> None:
+    _check_hook(file)
+    if file.exists():
+        content = file.read_bytes().decode("utf-8")
+        if line in content.splitlines():
+            return
+        content = content.rstrip("\n") + "\n" + line + "\n"
+    else:
+        lines = ["#!/bin/sh", _HOOK_MARKER]
+        if hook == "reference-transaction":
+            # This runs for each stage of a ref update; we only care once it's done.
+            lines.append('[ "$1" = "committed" ] || exit 0')
+        content = "\n".join([*lines, line]) + "\n"
+
+    file.write_bytes(content.encode("utf-8"))
+    file.chmod(0o755)
+
+
+def refresh_cache() -> None:
+    import tomlkit
+
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None:
+        raise RuntimeError("Unable to find pyproject.toml")
+
+    pyproject = tomlkit.parse(pyproject_path.read_bytes().decode("utf-8"))
+    config = _get_config(pyproject, pyproject_path=pyproject_path)
+    version = _refresh_version_cache(config, pyproject_path.parent.resolve())
+    if version is None:
+        raise RuntimeError("Unable to cache the version; this is only available for Git")
+
+    print("Cached version: {}".format(_serialize_version(version, config)), file=sys.stderr)
+
+
+def serve(socket: Optional[Path] = None) -> None:
+    from poetry_dynamic_versioning import server
+
+    server.serve(socket if socket is not None else _get_server_socket())
@@ -0,0 +1,245 @@
+import re
+import shlex
+import sys
+from pathlib import Path
+from typing import Iterator, List, Mapping, MutableMapping, Optional, Sequence, Tuple, Union  # noqa: F401
+from typing import TYPE_CHECKING
+
+from poetry_dynamic_versioning import (
+    _Config,
+    _find_git_dirs,
+    _match_tag,
+    _parse_git_timestamp,
+    _run_cmd,
+    _serialize_version,
+)
+
+if TYPE_CHECKING:
+    from dunamai import Version
+
+
+class _HistoryTag:
+    def __init__(self, name: str, position: int, ancestors: int, parsed: Optional["Version"]) -> None:
+        self.name = name
+        self.position = position
+        self.ancestors = ancestors
+        self.parsed = parsed
+
+    def is_higher_than(self, other: Optional["_HistoryTag"]) -> bool:
+        if other is None:
+            return True
+        try:
+            return self.parsed > other.parsed  # type: ignore
+        except Exception:
+            return False
+
+
+def _count_bits(value: int) -> int:
+    try:
+        return value.bit_count()  # type: ignore
+    except AttributeError:
+        return bin(value).count("1")
+
+
+def _get_ancestor_bits(segment: Tuple[int, List[int], int], size: int) -> int:
+    """
+    Turn an ancestor set from `_get_version_history` into a bit set by commit position.
+    This costs time in proportion to the whole history, so we only do it at merges and forks.
+    """
+    bits, positions, count = segment
+    data = bytearray((size >> 3) + 1)
+    for position in positions[:count]:
+        data[position >> 3] |= 1 << (position & 7)
+    return bits | int.from_bytes(data, "little")
+
+
+def _get_git_tags(path: Path) -> Mapping[str, Sequence[str]]:
+    """
+    Get the tag names for each commit, in the order that Dunamai would prefer them.
+    """
+    _, msg = _run_cmd(
+        'git for-each-ref "refs/tags/**" --format "%(refname:strip=2)'
+        "@{%(objectname)"
+        "@{%(*objectname)"
+        "@{%(creatordate:iso-strict)"
+        "@{%(*committerdate:iso-strict)"
+        "@{%(taggerdate:iso-strict)"
+        '"',
+        path=path,
+    )
+
+    dated = {}  # type: MutableMapping[str, list]
+    for line in msg.splitlines():
+        parts = line.split("@{")
+        if len(parts) != 6:
+            continue
+        name, oid, peeled, creatordate, committerdate, taggerdate = parts
+        raw_date = taggerdate or committerdate or creatordate
+        date = _parse_git_timestamp(raw_date) if raw_date else None
+        dated.setdefault(peeled or oid, []).append((name, date))
+
+    return {
+        commit: [name for name, _ in sorted(names, key=lambda x: (x[1] is not None, x[1]), reverse=True)]
+        for commit, names in dated.items()
+    }
+
+
+def _get_version_history(config: _Config, path: Optional[Path] = None, revision: str = "HEAD") -> Iterator[Mapping]:
+    """
+    Yield the version of each commit reachable from `revision`, oldest first.
+
+    Rather than asking Dunamai about every commit, this walks the commit graph once,
+    carrying forward each commit's number of ancestors and its candidate tags
+    in the same order as `git log --topo-order` would list them from that commit.
+    Since the selected tag is an ancestor, the distance is the difference between the two counts.
+    """
+    from dunamai import Concern, Pattern, Vcs, Version
+
+    if config["vcs"] not in ["any", "git"]:
+        raise RuntimeError("Version history is only available for Git repositories")
+
+    path = Path.cwd() if path is None else path
+    dirs = _find_git_dirs(path)
+    if dirs is None:
+        raise RuntimeError("Unable to find a Git repository")
+    if (dirs[1] / "shallow").is_file():
+        print("Warning: {}".format(Concern.ShallowRepository.message()), file=sys.stderr)
+
+    pattern = config["pattern"] if config["pattern"] is not None else Pattern.Default  # type: Union[str, Pattern]
+    parsed_pattern = Pattern.parse(pattern, config["pattern-prefix"])
+    latest = config["latest-tag"]
+    highest = config["highest-tag"] and not latest
+    full_commit = config["full-commit"] or config["commit-length"] is not None
+
+    _, msg = _run_cmd("git rev-parse --symbolic-full-name {}".format(shlex.quote(revision)), path=path)
+    branch = msg[len("refs/heads/") :] if msg.startswith("refs/heads/") else None
+
+    tags = _get_git_tags(path)
+
+    # Parents come before their children in this order.
+    _, msg = _run_cmd(
+        'git -c log.showsignature=false log --topo-order --reverse --format="%H %h %cI %P" {}'.format(
+            shlex.quote(revision)
+        ),
+        path=path,
+    )
+    commits = [line.split(" ") for line in msg.splitlines()]
+
+    children = {}  # type: MutableMapping[str, int]
+    for commit in commits:
+        for parent in commit[3:]:
+            children[parent] = children.get(parent, 0) + 1
+
+    index = {}  # type: MutableMapping[str, int]
+    ancestors = {}  # type: MutableMapping[str, int]
+    # These are only kept until the last child of a commit has been visited.
+    # `reachable` holds the ancestors of each commit, which we need to handle merges,
+    # as a bit set by position for the history up to the latest merge or fork,
+    # plus a list of positions (shared along a linear stretch) and how many of them belong to the commit.
+    # `candidates` holds linked lists of the tags in the order Dunamai would consider them,
+    # or just the highest tag when that option is enabled.
+    reachable = {}  # type: MutableMapping[str, Tuple[int, List[int], int]]
+    candidates = {}  # type: MutableMapping[str, Optional[tuple]]
+    highest_tags = {}  # type: MutableMapping[str, Optional[_HistoryTag]]
+    parent_bits = {}  # type: MutableMapping[str, int]
+
+    for position, (oid, short_oid, timestamp, *parents) in enumerate(commits):
+        parents = [x for x in parents if x in index]
+        index[oid] = position
+
+        if not parents:
+            segment = (0, [position], 1)
+            ancestors[oid] = 1
+        elif len(parents) == 1:
+            bits, positions, count = reachable[parents[0]]
+            if len(positions) == count:
+                positions.append(position)
+                segment = (bits, positions, count + 1)
+            else:
+                # Another child already continued this stretch.
+                segment = (_get_ancestor_bits(reachable[parents[0]], position), [position], 1)
+            ancestors[oid] = ancestors[parents[0]] + 1
+        else:
+            parent_bits = {x: _get_ancestor_bits(reachable[x], position) for x in parents}
+            bits = 1 << position
+            for parent in parents:
+                bits |= parent_bits[parent]
+            segment = (bits, [], 0)
+            ancestors[oid] = _count_bits(bits)
+
+        own = [
+            _HistoryTag(name, position, ancestors[oid], Version.parse(name, parsed_pattern) if highest else None)
+            for name in tags.get(oid, [])
+            if latest or re.search(parsed_pattern, name) is not None
+        ]
+
+        selected = None  # type: Optional[_HistoryTag]
+        if highest:
+            # Git lists the history of the last parent first.
+            for candidate in [*own, *(highest_tags[x] for x in reversed(parents))]:
+                if candidate is not None and candidate.is_higher_than(selected):
+                    selected = candidate
+            if children.get(oid, 0) > 0:
+                highest_tags[oid] = selected
+        else:
+            if len(parents) == 1:
+                chain = candidates[parents[0]]
+            else:
+                # Git lists the history of the last parent first,
+                # then whatever the earlier parents don't share with it, and so on.
+                merged = []
+                for i in reversed(range(len(parents))):
+                    shared = 0
+                    for earlier in parents[:i]:
+                        shared |= parent_bits[earlier]
+                    node = candidates[parents[i]]
+                    while node is not None:
+                        if not (shared >> node[0].position) & 1:
+                            merged.append(node[0])
+                        node = node[1]
+                chain = None
+                for tag in reversed(merged):
+                    chain = (tag, chain)
+            for tag in reversed(own):
+                chain = (tag, chain)
+            if chain is not None:
+                selected = chain[0]
+            if children.get(oid, 0) > 0:
+                candidates[oid] = chain
+
+        if children.get(oid, 0) > 0:
+            reachable[oid] = segment
+        for parent in parents:
+            children[parent] -= 1
+            if children[parent] == 0:
+                del reachable[parent]
+                candidates.pop(parent, None)
+                highest_tags.pop(parent, None)
+
+        matched = None
+        if selected is not None:
+            matched = _match_tag(selected.name, parsed_pattern)
+            if matched is None and latest:
+                raise ValueError("The pattern did not match the latest tag '{}'".format(selected.name))
+        if matched is None and config["strict"]:
+            raise RuntimeError("No tags available for commit {} and fallbacks disabled by strict mode".format(oid))
+
+        version = Version(
+            matched.base if matched is not None else "0.0.0",
+            stage=matched.stage_revision if matched is not None else None,
+            distance=ancestors[oid] - (selected.ancestors if matched is not None and selected is not None else 0),
+            commit=(oid if full_commit else short_oid)[: config["commit-length"]],
+            dirty=False,
+            tagged_metadata=matched.tagged_metadata if matched is not None else None,
+            epoch=matched.epoch if matched is not None else None,
+            branch=branch,
+            timestamp=_parse_git_timestamp(timestamp),
+            vcs=Vcs.Git,
+        )
+
+        yield {
+            "commit": oid,
+            "version": _serialize_version(version, config),
+            "tag": matched.name if matched is not None else None,
+            "distance": version.distance,
+        }
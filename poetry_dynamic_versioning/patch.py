@@ -1,13 +1,24 @@
 import atexit
 import functools
+from pathlib import Path
+from typing import Mapping, Optional
 
 from poetry_dynamic_versioning import (
+    _APPLIED_FILE,
+    _RESOLUTION_FILE,
     _revert_version,
     _get_and_apply_version,
     _get_config_from_path,
+    _get_pyproject_path,
     _get_pyproject_path_from_poetry,
+    _load_resolutions,
+    _release_shared_version,
+    _save_resolutions,
     _state,
 )
+from poetry_dynamic_versioning.artifacts import _substitute_version_in_artifacts
+
+_COMBINED_SETTING = "dynamic-versioning"
 
 
 def _patch_poetry_create(factory_mod) -> None:
@@ -53,6 +64,77 @@ def activate() -> None:
     atexit.register(deactivate)
 
 
+def substitute_artifact(path: Path) -> None:
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None:
+        return
+
+    for name, state in _state.projects.items():
+        if state.path.resolve() == pyproject_path.resolve():
+            _substitute_version_in_artifacts(name, [path])
+
+
+def save_resolutions(directory: Path) -> None:
+    if _state.projects:
+        _save_resolutions(directory / _RESOLUTION_FILE)
+
+
+def load_resolutions(directory: Path) -> None:
+    if _state.patched_core_poetry_create:
+        _load_resolutions(directory / _RESOLUTION_FILE)
+
+
+def is_combined_build(config_settings: Optional[Mapping]) -> bool:
+    return config_settings is not None and config_settings.get(_COMBINED_SETTING) == "combined"
+
+
+def keep_applied() -> None:
+    """
+    Leave the version applied when this process exits,
+    so that the next build hook can reuse it and revert it afterwards.
+    """
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None or not _state.projects:
+        return
+
+    _save_resolutions(pyproject_path.parent / _APPLIED_FILE, applied=True)
+    for state in _state.projects.values():
+        # The next build hook takes over reverting the version,
+        # so other processes shouldn't keep waiting on us.
+        if state.shared:
+            _release_shared_version(state)
+    _state.projects.clear()
+
+
+def resume_applied() -> None:
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None:
+        return
+
+    _load_resolutions(pyproject_path.parent / _APPLIED_FILE, applied=True)
+
+
+def discard_applied() -> None:
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None:
+        return
+
+    applied_file = pyproject_path.parent / _APPLIED_FILE
+    if applied_file.is_file():
+        applied_file.unlink()
+
+
+def finish_applied() -> None:
+    pyproject_path = _get_pyproject_path()
+    if pyproject_path is None:
+        return
+
+    applied_file = pyproject_path.parent / _APPLIED_FILE
+    if applied_file.is_file():
+        _revert_version()
+        applied_file.unlink()
+
+
 def deactivate() -> None:
     if not _state.cli_mode:
         _revert_version()
@@ -5,11 +5,15 @@ __all__ = [
 
 import functools
 import os
+import time
+from pathlib import Path
+from typing import Optional, Sequence
 
 from cleo.commands.command import Command
 from cleo.events.console_command_event import ConsoleCommandEvent
 from cleo.events.event_dispatcher import EventDispatcher
 from cleo.events.console_events import COMMAND, SIGNAL, TERMINATE, ERROR
+from cleo.helpers import option
 from packaging.version import Version as PackagingVersion
 from poetry.core import __version__ as poetry_core_version
 from poetry.core.poetry import Poetry
@@ -27,13 +31,23 @@ from poetry_dynamic_versioning import (
     cli,
     _get_config,
     _get_and_apply_version,
+    _get_pyproject_path,
     _get_pyproject_path_from_poetry,
+    _load_toml,
+    _prefetch_versions,
     _state,
     _revert_version,
 )
+from poetry_dynamic_versioning.artifacts import _substitute_version_in_artifacts
 
 _COMMAND_ENV = "POETRY_DYNAMIC_VERSIONING_COMMANDS"
 _COMMAND_NO_IO_ENV = "POETRY_DYNAMIC_VERSIONING_COMMANDS_NO_IO"
+# Commands where Poetry may load each path dependency to resolve it.
+_PREFETCH_COMMANDS = ["add", "install", "lock", "remove", "sync", "update"]
+# Commands that only need the version in memory, since they don't build or install anything.
+# `show --tree` is covered by `show`.
+# Commands like `install --no-root` still build path dependencies, which need their versions on disk.
+_NO_IO_COMMANDS = ["check", "export", "lock", "show", "version"]
 
 
 def _patch_dependency_versions(io: bool) -> None:
@@ -56,6 +70,26 @@ def _patch_dependency_versions(io: bool) -> None:
     _state.patched_core_poetry_create = True
 
 
+def _get_project_directory(application: Application) -> Path:
+    # Poetry 2.0.0+ resolves `--directory` and `--project` before loading plugins.
+    directory = getattr(application, "project_directory", None)
+    if directory is not None:
+        return Path(directory)
+
+    # Older versions only read `--directory` when loading the project,
+    # but the input has already been parsed by the time plugins are activated.
+    io = getattr(application, "_io", None)
+    if io is not None:
+        try:
+            directory = io.input.option("directory")
+        except Exception:
+            # Older versions don't have this option at all.
+            directory = None
+        if directory:
+            return Path(directory)
+    return Path.cwd()
+
+
 def _should_apply(command: str) -> bool:
     override = os.environ.get(_COMMAND_ENV)
     if override is not None:
@@ -69,7 +103,7 @@ def _should_apply_with_io(command: str) -> bool:
     if override is not None:
         return command not in override.split(",")
     else:
-        return command not in ["version"]
+        return command not in _NO_IO_COMMANDS
 
 
 def _apply_version_via_plugin(
@@ -80,7 +114,7 @@ def _apply_version_via_plugin(
     # fmt: off
     io: bool = True
     # fmt: on
-) -> None:
+) -> Optional[str]:
     name = _get_and_apply_version(
         pyproject_path=_get_pyproject_path_from_poetry(poetry.pyproject),
         retain=retain,
@@ -98,6 +132,22 @@ def _apply_version_via_plugin(
         if standalone:
             cli.report_apply(name)
 
+    return name
+
+
+def _get_new_artifacts(poetry: Poetry, command: Command, since: float) -> Sequence[Path]:
+    output = "dist"
+    if command.definition.has_option("output"):
+        output = command.option("output") or output
+
+    directory = Path(output)
+    if not directory.is_absolute():
+        directory = _get_pyproject_path_from_poetry(poetry.pyproject).parent / directory
+    if not directory.is_dir():
+        return []
+
+    return [x for x in directory.iterdir() if x.is_file() and x.stat().st_mtime >= since]
+
 
 class DynamicVersioningCommand(Command):
     name = cli.Command.dv
@@ -130,6 +180,10 @@ class DynamicVersioningEnableCommand(Command):
 class DynamicVersioningShowCommand(Command):
     name = cli.Command.dv_show
     description = cli.Help.show
+    options = [
+        option("format", None, cli.Help.show_format, flag=False, multiple=True),
+        option("output", None, cli.Help.show_output, flag=False, default="text"),
+    ]
 
     def __init__(self, application: Application):
         super().__init__()
@@ -137,13 +191,15 @@ class DynamicVersioningShowCommand(Command):
 
     def handle(self) -> int:
         _state.cli_mode = True
-        cli.show()
+        cli.show(self.option("format") or None, self.option("output"))
         return 0
 
 
 class DynamicVersioningPlugin(ApplicationPlugin):
     def __init__(self):
         self._application = None
+        self._name = None  # type: Optional[str]
+        self._started = 0
 
     def activate(self, application: Application) -> None:
         self._application = application
@@ -156,15 +212,17 @@ class DynamicVersioningPlugin(ApplicationPlugin):
             cli.Command.dv_show, lambda: DynamicVersioningShowCommand(application)
         )
 
-        try:
-            local = self._application.poetry.pyproject.data
-        except RuntimeError:
+        # Accessing `application.poetry` here would load the whole project,
+        # even for commands that we ignore, so we only read our own config for now.
+        pyproject_path = _get_pyproject_path(_get_project_directory(application))
+        if pyproject_path is None:
             # We're not in a Poetry project directory
             return
 
+        local = _load_toml(pyproject_path.read_bytes().decode("utf-8"))
         cli.validate(standalone=False, config=local)
 
-        config = _get_config(local)
+        config = _get_config(local, pyproject_path=pyproject_path)
         if not config["enable"]:
             return
 
@@ -179,12 +237,13 @@ class DynamicVersioningPlugin(ApplicationPlugin):
 
         io = _should_apply_with_io(event.command.name)
 
-        if hasattr(event.command, "poetry"):
-            poetry_instance = event.command.poetry
-        else:
-            poetry_instance = self._application.poetry
+        # Some file systems only track modification times to the second.
+        self._started = int(time.time())
+        poetry = self._get_poetry(event)
+        if event.command.name in _PREFETCH_COMMANDS:
+            _prefetch_versions(_get_pyproject_path_from_poetry(poetry.pyproject))
 
-        _apply_version_via_plugin(poetry_instance, io=io)
+        self._name = _apply_version_via_plugin(poetry, io=io)
         _patch_dependency_versions(io)
 
     def _revert_version(self, event: ConsoleCommandEvent, kind: str, dispatcher: EventDispatcher) -> None:
@@ -194,4 +253,15 @@ class DynamicVersioningPlugin(ApplicationPlugin):
         if not _should_apply_with_io(event.command.name):
             return
 
+        built = kind == TERMINATE and event.command.name == "build" and getattr(event, "exit_code", 0) == 0
+        if built and self._name in _state.projects:
+            artifacts = _get_new_artifacts(self._get_poetry(event), event.command, self._started)
+            _substitute_version_in_artifacts(self._name, artifacts)  # type: ignore
+
         _revert_version()
+
+    def _get_poetry(self, event: ConsoleCommandEvent) -> Poetry:
+        if hasattr(event.command, "poetry"):
+            return event.command.poetry
+        else:
+            return self._application.poetry
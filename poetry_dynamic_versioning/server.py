@@ -0,0 +1,123 @@
+import copy
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from pathlib import Path
+from typing import Mapping, MutableMapping, Tuple, TYPE_CHECKING  # noqa: F401
+
+from poetry_dynamic_versioning import (
+    _debug,
+    _get_version_from_dunamai,
+    _is_git_dirty,
+    _vcs_fingerprint,
+    _version_to_dict,
+)
+
+if TYPE_CHECKING:
+    from dunamai import Version
+
+
+class _Entry:
+    def __init__(self, fingerprint: Tuple, version: "Version") -> None:
+        self.fingerprint = fingerprint
+        self.version = version
+
+
+class _Cache:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.entries = {}  # type: MutableMapping[str, _Entry]
+
+    def query(self, request: Mapping) -> Mapping:
+        from dunamai import Pattern, Vcs
+
+        path = Path(request["path"])
+        config = request["config"]
+        strict = request["strict"]
+        key = json.dumps([request["path"], config, strict], sort_keys=True)
+
+        fingerprint = _vcs_fingerprint(path)
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if fingerprint is not None and entry is not None and entry.fingerprint == fingerprint:
+            version = copy.copy(entry.version)
+            if request["dirty"]:
+                # Changes in the working tree don't show up in the fingerprint.
+                dirty = _is_git_dirty(path, config["ignore-untracked"])
+                if dirty is not None:
+                    version.dirty = dirty
+            _debug("Reusing cached version for '{}'".format(path))
+        else:
+            vcs = Vcs(config["vcs"])
+            pattern = config["pattern"] if config["pattern"] is not None else Pattern.Default
+            version = _get_version_from_dunamai(vcs, pattern, config, strict=strict, path=path, server=False)
+            if fingerprint is not None:
+                with self.lock:
+                    self.entries[key] = _Entry(fingerprint, version)
+
+        return {
+            "version": _version_to_dict(version),
+            "concerns": sorted(x.value for x in version.concerns),
+        }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        try:
+            response = self.server.cache.query(json.loads(line.decode("utf-8")))  # type: ignore
+        except Exception as e:
+            response = {"error": str(e)}
+
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path) -> None:
+        self.cache = _Cache()
+        super().__init__(str(path), _Handler)
+
+
+def _is_running(path: Path) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(path))
+        return True
+    except OSError:
+        return False
+
+
+def serve(path: Path) -> None:
+    if not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("The version server requires Unix domain sockets, which aren't available here")
+
+    if path.exists():
+        if _is_running(path):
+            raise RuntimeError("A version server is already listening on {}".format(path))
+        # Left over from a server that didn't shut down cleanly.
+        path.unlink()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    server = _Server(path)
+    # Make sure that we clean up the socket when stopped by a service manager.
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        os.chmod(str(path), 0o600)
+        print("Listening on {}".format(path), file=sys.stderr)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if path.exists():
+            path.unlink()
@@ -1,6 +1,15 @@
+import datetime as dt
+import io
+import json
 import os
+import socket
+import subprocess
+import sys
+import tarfile
 import textwrap
+import zipfile
 from pathlib import Path
+from typing import Sequence
 
 import pytest
 import tomlkit
@@ -47,6 +56,75 @@ def test__get_config_from_path__with_plugin_customizations():
     assert config["tag-dir"] == "alt/tags"
 
 
+def test__get_local_config_from_path(tmp_path):
+    assert plugin._get_local_config_from_path(tmp_path) is None
+
+    (tmp_path / "pyproject.toml").write_text('[tool.poetry]\nname = "foo"\n')
+    assert plugin._get_local_config_from_path(tmp_path) == {}
+
+    (tmp_path / "pyproject.toml").write_text("[tool.poetry-dynamic-versioning]\nenable = true\n")
+    config = plugin._get_local_config_from_path(tmp_path)
+    assert config == {"tool": {"poetry-dynamic-versioning": {"enable": True}}}
+
+
+def test__get_config_from_path__inherit(tmp_path):
+    (tmp_path / "pyproject.toml").write_text('[tool.poetry-dynamic-versioning]\nenable = true\nvcs = "git"\n')
+    (tmp_path / "libs").mkdir()
+    (tmp_path / "libs" / "poetry-dynamic-versioning.toml").write_text(
+        '[tool.poetry-dynamic-versioning]\ninherit = true\nstyle = "semver"\n'
+        '[tool.poetry-dynamic-versioning.substitution]\nfiles = ["_version.py"]\n'
+    )
+    for name in ["foo", "bar"]:
+        (tmp_path / "libs" / name).mkdir()
+        (tmp_path / "libs" / name / "pyproject.toml").write_text(
+            "[tool.poetry-dynamic-versioning]\ninherit = true\n"
+            '[tool.poetry-dynamic-versioning.substitution]\ntarget = "artifacts"\n'
+        )
+
+    plugin._load_config_file.cache_clear()
+    for name in ["foo", "bar"]:
+        config = plugin._get_config_from_path(tmp_path / "libs" / name)
+        assert config["enable"] is True
+        assert config["vcs"] == "git"
+        assert config["style"] == "semver"
+        assert config["substitution"]["files"] == ["_version.py"]
+        assert config["substitution"]["target"] == "artifacts"
+    # Each of the inherited files is only parsed once.
+    assert plugin._load_config_file.cache_info().misses == 2
+
+    # Without `inherit`, ancestor configs are ignored.
+    (tmp_path / "libs" / "foo" / "pyproject.toml").write_text("[tool.poetry-dynamic-versioning]\n")
+    assert plugin._get_config_from_path(tmp_path / "libs" / "foo")["enable"] is False
+
+
+def test__get_and_apply_version__inherit_in_sdist(tmp_path):
+    workspace = tmp_path / "workspace"
+    project = workspace / "foo"
+    project.mkdir(parents=True)
+    (workspace / "pyproject.toml").write_text("[tool.poetry-dynamic-versioning]\nenable = true\n")
+    original = '[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n\n[tool.poetry-dynamic-versioning]\ninherit = true\n'
+    (project / "pyproject.toml").write_text(original)
+    init_git_repo(project, "v1.2.3")
+
+    session = plugin._State()
+    assert plugin._get_and_apply_version(project / "pyproject.toml", session=session) == "foo"
+
+    # The source distribution has no parent config, but it shouldn't need one.
+    unpacked = tmp_path / "unpacked"
+    unpacked.mkdir()
+    (unpacked / "pyproject.toml").write_bytes((project / "pyproject.toml").read_bytes())
+    assert "inherit" not in (unpacked / "pyproject.toml").read_text()
+    assert plugin._get_config_from_path(unpacked)["enable"] is False
+
+    plugin._revert_version(session=session)
+    assert tomlkit.parse((project / "pyproject.toml").read_text()) == tomlkit.parse(
+        original.replace("inherit = true", "inherit = true\nenable = true")
+    )
+
+    (unpacked / "pyproject.toml").write_text("[tool.poetry-dynamic-versioning]\nenable = false\ninherit = true\n")
+    assert plugin._get_config_from_path(unpacked)["enable"] is False
+
+
 def test__get_config__bump():
     config = plugin._get_config({"tool": {"poetry-dynamic-versioning": {"bump": True}}})
     bump = plugin._BumpConfig.from_config(config["bump"])
@@ -102,6 +180,39 @@ def test__get_version__format_jinja_imports_with_module_and_item(config):
     assert plugin._get_version(config)[0] == "8.0"
 
 
+def test__needs_dirty(config):
+    assert not plugin._needs_dirty(config)
+
+    config["formats"] = {"plain": {"style": "semver"}}
+    assert not plugin._needs_dirty(config)
+
+    config["formats"] = {"plain": {"dirty": True}}
+    assert plugin._needs_dirty(config)
+
+    config["formats"] = {"plain": {"format": "{base}+{dirty}"}}
+    assert plugin._needs_dirty(config)
+
+
+def test__serialize_formats(config):
+    config["format-jinja"] = "{{ base }}-main"
+    config["style"] = "semver"
+    config["formats"] = {
+        "plain": {"format": "{base}"},
+        "safe": {"format-jinja": "{{ base | replace('.', '_') }}", "style": None},
+    }
+    version = Version("1.2.3", distance=4, commit="abc")
+
+    assert plugin._serialize_formats(version, config) == {"plain": "1.2.3", "safe": "1_2_3"}
+
+
+def test__format_versions():
+    formats = {"semver": "1.2.3", "file-safe": "1_2_3"}
+
+    assert cli._format_versions("1.2.3", formats, "text") == "1.2.3\n1.2.3\n1_2_3"
+    assert json.loads(cli._format_versions("1.2.3", formats, "json")) == {"version": "1.2.3", "formats": formats}
+    assert cli._format_versions(None, formats, "env") == "VERSION_SEMVER=1.2.3\nVERSION_FILE_SAFE=1_2_3"
+
+
 def test__get_override_version__bypass():
     env = {plugin._BYPASS_ENV: "0.1.0"}
     assert plugin._get_override_version(None, env) == "0.1.0"
@@ -122,6 +233,41 @@ def test__get_override_version__combined():
     assert plugin._get_override_version("foo", env) == "0.1.0"
 
 
+def test__get_override_version__manifest(tmp_path):
+    manifest = tmp_path / "versions.json"
+    manifest.write_text(cli._format_manifest({"foo": "0.1.0", "bar": "0.2.0"}, "json"))
+    env = {plugin._MANIFEST_ENV: str(manifest), plugin._OVERRIDE_ENV: "bar=0.3.0"}
+
+    assert plugin._get_override_version("foo", env) == "0.1.0"
+    assert plugin._get_override_version("bar", env) == "0.3.0"
+    assert plugin._get_override_version("baz", env) is None
+
+    assert cli._format_manifest({"foo": "0.1.0", "bar": "0.2.0"}, "env") == "{}=bar=0.2.0,foo=0.1.0".format(
+        plugin._OVERRIDE_ENV
+    )
+
+
+def test__get_workspace_projects(tmp_path):
+    for name, dependencies, enable in [
+        ("root", ["a"], False),
+        ("a", ["b", "c"], True),
+        ("b", ["a"], True),
+        ("c", [], False),
+    ]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "pyproject.toml").write_text(
+            '[tool.poetry]\nname = "{}"\n\n[tool.poetry.dependencies]\n{}\n\n'
+            "[tool.poetry-dynamic-versioning]\nenable = {}\n".format(
+                name,
+                "\n".join('{} = {{ path = "../{}" }}'.format(x, x) for x in dependencies),
+                str(enable).lower(),
+            )
+        )
+
+    projects = plugin._get_workspace_projects(tmp_path / "root" / "pyproject.toml")
+    assert projects == [(tmp_path / x / "pyproject.toml").resolve() for x in ["root", "a", "b"]]
+
+
 def test__enable_in_doc__empty():
     doc = tomlkit.parse("")
     updated = cli._enable_in_doc(doc)
@@ -392,3 +538,924 @@ def test__substitute_version_in_text__mixed():
         plugin._default_config()["tool"]["poetry-dynamic-versioning"]["substitution"]["patterns"]
     )
     assert plugin._substitute_version_in_text(version, content, patterns) == output
+
+
+def test__render_version_module():
+    version = "0.1.2.dev0-post.4+meta.data"
+    content = plugin._render_version_module(version, Version("0.1.2", distance=4, commit="abc1234"))
+    namespace = {}  # type: dict
+    exec(content, namespace)
+    assert namespace["__version__"] == version
+    assert namespace["__version_tuple__"] == (0, 1, 2, "dev0", "post", 4, "meta.data")
+    assert namespace["__commit__"] == "abc1234"
+    assert namespace["__distance__"] == 4
+
+    # Substitution should agree with the generated values.
+    patterns = plugin._SubPattern.from_config(
+        plugin._default_config()["tool"]["poetry-dynamic-versioning"]["substitution"]["patterns"]
+    )
+    assert plugin._substitute_version_in_text(version, content, patterns) == content
+
+
+def test__substitute_version_in_wheel(tmp_path):
+    from poetry_dynamic_versioning import artifacts
+
+    wheel = tmp_path / "pkg-0.1.2-py3-none-any.whl"
+    original = b'__version__ = "0.0.0"\n'
+    updated = b'__version__ = "0.1.2"\n'
+    with zipfile.ZipFile(str(wheel), "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("pkg/__init__.py", original)
+        zf.writestr("pkg/other.py", b"x = 1\n")
+        # Members over 2 GiB use ZIP64 extensions, which we force here to keep the test small.
+        with zf.open("pkg/data.bin", "w", force_zip64=True) as f:
+            f.write(b"\0" * 100000)
+        zf.writestr(
+            "pkg-0.1.2.dist-info/RECORD",
+            "pkg/__init__.py,{},{}\npkg/other.py,sha256=abc,6\npkg-0.1.2.dist-info/RECORD,,\n".format(
+                artifacts._hash_record_entry(original), len(original)
+            ),
+        )
+
+    assert artifacts._substitute_version_in_wheel(wheel, {"src/pkg/__init__.py": (original, updated)})
+
+    with zipfile.ZipFile(str(wheel)) as zf:
+        assert zf.testzip() is None
+        assert zf.read("pkg/__init__.py") == updated
+        assert zf.read("pkg/other.py") == b"x = 1\n"
+        assert zf.getinfo("pkg/other.py").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.read("pkg/data.bin") == b"\0" * 100000
+        assert zf.read("pkg-0.1.2.dist-info/RECORD").decode("utf-8") == (
+            "pkg/__init__.py,{},{}\npkg/other.py,sha256=abc,6\npkg-0.1.2.dist-info/RECORD,,\n".format(
+                artifacts._hash_record_entry(updated), len(updated)
+            )
+        )
+
+    assert not artifacts._substitute_version_in_wheel(wheel, {"pkg/__init__.py": (original, updated)})
+
+
+def test__substitute_version_in_sdist(tmp_path):
+    from poetry_dynamic_versioning import artifacts
+
+    sdist = tmp_path / "pkg-0.1.2.tar.gz"
+    original = b'__version__ = "0.0.0"\n'
+    updated = b'__version__ = "0.1.2"\n'
+    with tarfile.open(str(sdist), "w:gz") as tf:
+        for name, content in [
+            ("pkg-0.1.2/pkg/__init__.py", original),
+            ("pkg-0.1.2/pkg/other.py", b"x = 1\n"),
+            ("pkg-0.1.2/pyproject.toml", b'[tool.poetry]\nversion = "0.0.0"\n'),
+        ]:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tf.addfile(info, io.BytesIO(content))
+
+    assert artifacts._substitute_version_in_sdist(
+        sdist, {"pkg/__init__.py": (original, updated)}, b'[tool.poetry]\nversion = "0.1.2"\n'
+    )
+
+    with tarfile.open(str(sdist)) as tf:
+        assert tf.extractfile("pkg-0.1.2/pkg/__init__.py").read() == updated  # type: ignore
+        assert tf.extractfile("pkg-0.1.2/pkg/other.py").read() == b"x = 1\n"  # type: ignore
+        assert tf.extractfile("pkg-0.1.2/pyproject.toml").read() == (  # type: ignore
+            b'[tool.poetry]\nversion = "0.1.2"\n'
+        )
+
+
+def test__write_if_changed(tmp_path):
+    file = tmp_path / "foo.txt"
+    assert plugin._write_if_changed(file, b"foo")
+    os.utime(str(file), ns=(0, 0))
+
+    assert not plugin._write_if_changed(file, b"foo")
+    assert file.stat().st_mtime_ns == 0
+
+    assert plugin._write_if_changed(file, b"bar")
+    assert file.read_bytes() == b"bar"
+
+
+def test__version_to_dict__round_trip():
+    version = Version(
+        "1.2.3",
+        stage=("rc", 4),
+        distance=5,
+        commit="abc",
+        dirty=True,
+        tagged_metadata="meta",
+        epoch=1,
+        branch="main",
+        timestamp=dt.datetime(2024, 1, 2, 3, 4, 5, tzinfo=dt.timezone.utc),
+    )
+    restored = plugin._version_from_dict(json.loads(json.dumps(plugin._version_to_dict(version))))
+    assert restored == version
+    assert restored.serialize(metadata=True, dirty=True) == version.serialize(metadata=True, dirty=True)
+    assert restored.timestamp == version.timestamp
+    assert restored.branch == "main"
+
+
+def test__get_and_apply_version__memoized_outcome(tmp_path, monkeypatch):
+    import tomlkit
+
+    monkeypatch.setattr(plugin, "_state", plugin._State())
+    pyproject = tmp_path / "pyproject.toml"
+    pyproject.write_text('[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n')
+    assert plugin._get_and_apply_version(pyproject_path=pyproject) is None
+
+    def fail(*args, **kwargs):
+        raise AssertionError("pyproject.toml was parsed again")
+
+    with monkeypatch.context() as m:
+        m.setattr(tomlkit, "parse", fail)
+        assert plugin._get_and_apply_version(pyproject_path=pyproject) is None
+
+    pyproject.write_text('[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n\n[tool.other]\n')
+    with pytest.raises(AssertionError):
+        with monkeypatch.context() as m:
+            m.setattr(tomlkit, "parse", fail)
+            plugin._get_and_apply_version(pyproject_path=pyproject)
+
+
+def test__get_path_dependencies():
+    pyproject = {
+        "project": {
+            "dependencies": [
+                "foo @ file:///work/foo",
+                "bar[extra] @ file:///work/my%20bar ; python_version >= '3.8'",
+                "baz @ https://example.com/baz.whl",
+                "qux >= 1.0",
+            ],
+            "optional-dependencies": {"test": ["quux @ file:../quux"]},
+        },
+        "tool": {"poetry": {"dependencies": {"corge": {"path": "../corge"}}}},
+    }
+    assert plugin._get_path_dependencies(pyproject) == ["../corge", "/work/foo", "/work/my bar", "../quux"]
+
+
+def test__prefetch_versions(tmp_path, monkeypatch):
+    monkeypatch.setattr(plugin, "_state", plugin._State())
+    monkeypatch.setattr(plugin, "_get_version", lambda config, name, path=None: (path.name, Version("1.2.3")))
+
+    for name in ["foo", "bar"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "pyproject.toml").write_text(
+            '[tool.poetry]\nname = "{}"\nversion = "0.0.0"\n\n'
+            "[tool.poetry-dynamic-versioning]\nenable = {}\n".format(name, "true" if name == "foo" else "false")
+        )
+    (tmp_path / "root").mkdir()
+    (tmp_path / "root" / "pyproject.toml").write_text(
+        '[tool.poetry.dependencies]\nfoo = {path = "../foo"}\n\n'
+        '[tool.poetry.group.dev.dependencies]\nbar = {path = "../bar"}\n\n'
+        "[tool.poetry-dynamic-versioning]\nenable = true\n"
+    )
+
+    plugin._prefetch_versions(tmp_path / "root" / "pyproject.toml")
+
+    assert list(plugin._state.prefetched) == [str((tmp_path / "foo" / "pyproject.toml").resolve())]
+    fingerprint, future = plugin._state.prefetched[str((tmp_path / "foo" / "pyproject.toml").resolve())]
+    assert future.result() == ("foo", Version("1.2.3"))
+
+
+def init_git_repo(path: Path, tag: str) -> None:
+    run_git_commands(path, ["git init -q", "git add .", "git commit -q -m init", "git tag {}".format(tag)])
+
+
+def run_git_commands(path: Path, commands: Sequence[str]) -> None:
+    env = {
+        **os.environ,
+        "GIT_AUTHOR_NAME": "x",
+        "GIT_AUTHOR_EMAIL": "x@example.com",
+        "GIT_COMMITTER_NAME": "x",
+        "GIT_COMMITTER_EMAIL": "x@example.com",
+    }
+    for command in commands:
+        subprocess.run(command.split(" "), cwd=str(path), check=True, env=env)
+
+
+def test__get_and_apply_version__threads_without_chdir(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Changed directory")
+
+    monkeypatch.setattr(plugin.os, "chdir", fail)
+
+    paths = []
+    for i in range(4):
+        project = tmp_path / "project{}".format(i)
+        project.mkdir()
+        (project / "pyproject.toml").write_text(
+            '[tool.poetry]\nname = "project{}"\nversion = "0.0.0"\n\n'
+            "[tool.poetry-dynamic-versioning]\nenable = true\n".format(i)
+        )
+        init_git_repo(project, "v1.{}.0".format(i))
+        paths.append(project / "pyproject.toml")
+
+    session = plugin._State()
+    with ThreadPoolExecutor(4) as executor:
+        names = list(executor.map(lambda path: plugin._get_and_apply_version(path, session=session), paths))
+
+    assert names == ["project0", "project1", "project2", "project3"]
+    assert [session.projects[name].version for name in names] == ["1.0.0", "1.1.0", "1.2.0", "1.3.0"]
+    assert not plugin._state.projects
+
+    plugin._revert_version(session=session)
+    assert not session.projects
+    assert 'version = "0.0.0"' in paths[0].read_text()
+
+
+def test__session__apply_and_revert(tmp_path):
+    original = '[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n'
+    (tmp_path / "pyproject.toml").write_text(original)
+    (tmp_path / "foo").mkdir()
+    (tmp_path / "foo" / "__init__.py").write_text('__version__ = "0.0.0"\n')
+    init_git_repo(tmp_path, "v1.2.3")
+
+    result = plugin.get_version(tmp_path / "foo", config={"style": "semver"})
+    assert result.name == "foo"
+    assert result.version == "1.2.3"
+    assert result.instance.base == "1.2.3"
+    assert result.files == [(tmp_path / "foo" / "__init__.py").resolve()]
+    assert set(result.timings) == {"config", "vcs", "files", "total"}
+
+    with plugin.Session() as session:
+        result = session.get_version(tmp_path)
+        with result.applied():
+            assert 'version = "1.2.3"' in (tmp_path / "pyproject.toml").read_text()
+            assert (tmp_path / "foo" / "__init__.py").read_text() == '__version__ = "1.2.3"\n'
+        assert (tmp_path / "pyproject.toml").read_text() == original
+        assert (tmp_path / "foo" / "__init__.py").read_text() == '__version__ = "0.0.0"\n'
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Requires Unix sockets")
+def test__get_version__from_server(tmp_path, monkeypatch, config):
+    import threading
+
+    from poetry_dynamic_versioning import server
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "pyproject.toml").write_text('[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n')
+    init_git_repo(repo, "v1.2.3")
+
+    queries = []
+    original = server._get_version_from_dunamai
+
+    def counted(*args, **kwargs):
+        queries.append(kwargs["path"])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(server, "_get_version_from_dunamai", counted)
+    monkeypatch.setenv(plugin._SERVER_ENV, str(tmp_path / "server.sock"))
+
+    instance = server._Server(tmp_path / "server.sock")
+    thread = threading.Thread(target=instance.serve_forever)
+    thread.start()
+    try:
+        assert plugin._get_version(config, path=repo)[0] == "1.2.3"
+        assert plugin._get_version(config, path=repo)[0] == "1.2.3"
+        assert queries == [repo]
+
+        subprocess.run(["git", "tag", "-d", "v1.2.3"], cwd=str(repo), check=True, stdout=subprocess.DEVNULL)
+        subprocess.run(["git", "tag", "v1.2.4"], cwd=str(repo), check=True)
+        assert plugin._get_version(config, path=repo)[0] == "1.2.4"
+        assert queries == [repo, repo]
+    finally:
+        instance.shutdown()
+        instance.server_close()
+        thread.join()
+
+
+def test__get_version_from_server__unserializable_config(tmp_path, monkeypatch, config):
+    monkeypatch.setenv(plugin._SERVER_ENV, str(tmp_path / "server.sock"))
+    (tmp_path / "server.sock").write_text("")
+    config["formats"] = {"dated": {"format": "{base}", "since": tomlkit.item(dt.date(2024, 1, 1))}}
+
+    # The caller resolves the version itself instead of failing.
+    assert plugin._get_version_from_server(config, False, tmp_path) is None
+
+
+def test_backend__combined_build_discards_leftovers(tmp_path, monkeypatch):
+    from poetry_dynamic_versioning import backend
+
+    (tmp_path / "pyproject.toml").write_text("")
+    applied = tmp_path / plugin._APPLIED_FILE
+    monkeypatch.chdir(tmp_path)
+    settings = {"dynamic-versioning": "combined"}
+
+    def fail(*args):
+        raise RuntimeError("Build failed")
+
+    monkeypatch.setattr(backend._api, "build_sdist", lambda *args: "foo-0.1.0.tar.gz")
+    monkeypatch.setattr(backend._api, "build_wheel", fail)
+
+    # A failed wheel build still cleans up after itself.
+    applied.write_text('{"projects": {}}')
+    with pytest.raises(RuntimeError):
+        backend.build_wheel(str(tmp_path), settings)
+    assert not applied.exists()
+
+    # The sdist build doesn't reuse a leftover from a build that never finished.
+    applied.write_text('{"projects": {}}')
+    backend.build_sdist(str(tmp_path), settings)
+    assert not applied.exists()
+
+
+def test__get_and_apply_version__shared_between_sessions(tmp_path, monkeypatch):
+    monkeypatch.setenv(plugin._CACHE_DIR_ENV, str(tmp_path / "cache"))
+    project = tmp_path / "project"
+    project.mkdir()
+    original = '[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n\n[tool.poetry-dynamic-versioning]\nenable = true\n'
+    (project / "pyproject.toml").write_text(original)
+    init_git_repo(project, "v1.2.3")
+
+    first = plugin._State(share_results=True)
+    second = plugin._State(share_results=True)
+    assert plugin._get_and_apply_version(project / "pyproject.toml", session=first) == "foo"
+    modified = (project / "pyproject.toml").read_text()
+    assert 'version = "1.2.3"' in modified
+
+    # The second session reuses the applied version instead of reading the modified file.
+    assert plugin._get_and_apply_version(project / "pyproject.toml", session=second) == "foo"
+    assert second.projects["foo"].version == "1.2.3"
+
+    plugin._revert_version(session=first)
+    assert (project / "pyproject.toml").read_text() == modified
+
+    plugin._revert_version(session=second)
+    assert (project / "pyproject.toml").read_text() == original
+    assert not plugin._get_shared_file(project / "pyproject.toml").exists()
+
+
+def test__get_and_apply_version__stale_shared_record(tmp_path, monkeypatch):
+    monkeypatch.setenv(plugin._CACHE_DIR_ENV, str(tmp_path / "cache"))
+    project = tmp_path / "project"
+    project.mkdir()
+    original = '[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n\n[tool.poetry-dynamic-versioning]\nenable = true\n'
+    (project / "pyproject.toml").write_text(original)
+    init_git_repo(project, "v1.2.3")
+
+    first = plugin._State(share_results=True)
+    assert plugin._get_and_apply_version(project / "pyproject.toml", session=first) == "foo"
+
+    # Simulate a killed run whose record still looks alive,
+    # followed by a fresh checkout with a newer version.
+    (project / "pyproject.toml").write_text(original)
+    run_git_commands(project, ["git commit -q --allow-empty -m next", "git tag v2.0.0"])
+
+    second = plugin._State(share_results=True)
+    assert plugin._get_and_apply_version(project / "pyproject.toml", session=second) == "foo"
+    assert second.projects["foo"].version == "2.0.0"
+    assert second.projects["foo"].original_version == "0.0.0"
+
+    plugin._revert_version(session=second)
+    assert (project / "pyproject.toml").read_text() == original
+
+
+def test__get_and_apply_version__shared_with_different_settings(tmp_path, monkeypatch):
+    monkeypatch.setenv(plugin._CACHE_DIR_ENV, str(tmp_path / "cache"))
+    project = tmp_path / "project"
+    project.mkdir()
+    original = '[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n\n[tool.poetry-dynamic-versioning]\nenable = true\n'
+    (project / "pyproject.toml").write_text(original)
+    init_git_repo(project, "v1.2.3")
+
+    first = plugin._State(share_results=True)
+    assert plugin._get_and_apply_version(project / "pyproject.toml", session=first) == "foo"
+    record = plugin._get_shared_file(project / "pyproject.toml").read_text()
+
+    # A process with an override doesn't adopt a version that was resolved without it.
+    monkeypatch.setenv(plugin._OVERRIDE_ENV, "foo=9.9.9")
+    second = plugin._State(share_results=True)
+    plugin._get_and_apply_version(project / "pyproject.toml", session=second)
+    assert "foo" not in second.projects
+    assert plugin._get_shared_file(project / "pyproject.toml").read_text() == record
+
+    plugin._revert_version(session=first)
+    assert (project / "pyproject.toml").read_text() == original
+    assert not plugin._get_shared_file(project / "pyproject.toml").exists()
+
+
+def test__read_shared_file__dead_holder(tmp_path, monkeypatch):
+    monkeypatch.setenv(plugin._CACHE_DIR_ENV, str(tmp_path / "cache"))
+    holders = tmp_path / "cache" / "shared" / "holders"
+    holders.mkdir(parents=True)
+    (holders / "123-dead").write_text("")
+    record = tmp_path / "cache" / "shared" / "record.json"
+    record.write_text('{"holders": ["123-dead", "456-missing"]}')
+
+    # Nobody holds the lock on the holder file, even if process 123 happens to exist.
+    assert plugin._read_shared_file(record) is None
+    assert not record.exists()
+    assert not (holders / "123-dead").exists()
+
+
+def test_keep_applied__releases_shared_version(tmp_path, monkeypatch):
+    from poetry_dynamic_versioning import patch
+
+    monkeypatch.setenv(plugin._CACHE_DIR_ENV, str(tmp_path / "cache"))
+    original = '[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n\n[tool.poetry-dynamic-versioning]\nenable = true\n'
+    (tmp_path / "pyproject.toml").write_text(original)
+    init_git_repo(tmp_path, "v1.2.3")
+    monkeypatch.chdir(tmp_path)
+    session = plugin._State(share_results=True)
+    monkeypatch.setattr(patch, "_state", session)
+    monkeypatch.setattr(plugin, "_state", session)
+
+    assert plugin._get_and_apply_version(tmp_path / "pyproject.toml") == "foo"
+    assert plugin._get_shared_file(tmp_path / "pyproject.toml").exists()
+
+    patch.keep_applied()
+    assert not plugin._get_shared_file(tmp_path / "pyproject.toml").exists()
+    assert (tmp_path / plugin._APPLIED_FILE).exists()
+
+    patch.resume_applied()
+    patch.finish_applied()
+    assert (tmp_path / "pyproject.toml").read_text() == original
+
+
+def test__is_git_dirty(tmp_path):
+    (tmp_path / "foo.txt").write_text("foo")
+    init_git_repo(tmp_path, "v1.2.3")
+    index_mtime = (tmp_path / ".git" / "index").stat().st_mtime_ns
+
+    assert plugin._is_git_dirty(tmp_path, ignore_untracked=False) is False
+
+    (tmp_path / "bar.txt").write_text("bar")
+    assert plugin._is_git_dirty(tmp_path, ignore_untracked=False) is True
+    assert plugin._is_git_dirty(tmp_path, ignore_untracked=True) is False
+
+    (tmp_path / "foo.txt").write_text("changed")
+    assert plugin._is_git_dirty(tmp_path, ignore_untracked=True) is True
+
+    assert (tmp_path / ".git" / "index").stat().st_mtime_ns == index_mtime
+
+
+def test__match_tag():
+    from dunamai import Pattern
+
+    pattern = Pattern.parse(Pattern.Default)
+    matched = plugin._match_tag("v1.2.3rc4+foo", pattern)
+    assert matched is not None
+    assert (matched.base, matched.stage_revision, matched.tagged_metadata) == ("1.2.3", ("rc", 4), "foo")
+    assert plugin._match_tag("other", pattern) is None
+
+
+def test__find_matched_tag(config, tmp_path):
+    from dunamai import Pattern
+
+    (tmp_path / "foo.txt").write_text("foo")
+    init_git_repo(tmp_path, "v1.2.3")
+    run_git_commands(tmp_path, ["git commit -q --allow-empty -m a", "git tag v1.2.4", "git tag other"])
+
+    version = Version.from_git(path=tmp_path)
+    assert plugin._find_matched_tag(version, Pattern.Default, config, tmp_path) == "v1.2.4"
+
+    version = Version("1.2.3", distance=1)
+    assert plugin._find_matched_tag(version, Pattern.Default, config, tmp_path) == "v1.2.3"
+
+    # The fallback version, or a version from the right tag but the wrong commit.
+    for version in [Version("0.0.0", distance=2), Version("1.2.3", distance=2)]:
+        assert plugin._find_matched_tag(version, Pattern.Default, config, tmp_path) is None
+
+
+def test__get_version_history__matches_checkouts(config, tmp_path):
+    from poetry_dynamic_versioning.history import _get_version_history
+
+    (tmp_path / "foo.txt").write_text("foo")
+    init_git_repo(tmp_path, "v1.0.0")
+    run_git_commands(
+        tmp_path,
+        [
+            "git checkout -q -b feature",
+            "git commit -q --allow-empty -m a",
+            "git tag v1.1.0a1",
+            "git commit -q --allow-empty -m b",
+            "git checkout -q -",
+            "git commit -q --allow-empty -m c",
+            "git tag other",
+            "git commit -q --allow-empty -m d",
+            "git merge -q --no-edit feature",
+            "git commit -q --allow-empty -m e",
+        ],
+    )
+
+    entries = list(_get_version_history(config, tmp_path))
+    assert len(entries) == 7
+
+    for entry in entries:
+        subprocess.run(["git", "checkout", "-q", entry["commit"]], cwd=str(tmp_path), check=True)
+        assert entry["version"] == plugin._get_version(config, path=tmp_path)[0]
+
+
+def test__get_version_history__long_linear_history(config, tmp_path, monkeypatch):
+    from poetry_dynamic_versioning import history
+
+    (tmp_path / "foo.txt").write_text("foo")
+    init_git_repo(tmp_path, "v1.0.0")
+    branch = subprocess.run(
+        ["git", "symbolic-ref", "HEAD"], cwd=str(tmp_path), check=True, stdout=subprocess.PIPE
+    ).stdout.decode("utf-8")
+
+    # Appending commits one by one with `git commit` would take too long.
+    stream = "commit {}committer x <x@example.com> 1600000000 +0000\ndata 1\nx\nfrom HEAD^0\n".format(branch)
+    for i in range(1, 5000):
+        stream += "commit {}committer x <x@example.com> {} +0000\ndata 1\nx\n".format(branch, 1600000000 + i)
+    subprocess.run(
+        ["git", "fast-import", "--quiet", "--force"], cwd=str(tmp_path), input=stream.encode("utf-8"), check=True
+    )
+    run_git_commands(tmp_path, ["git reset -q --hard", "git tag v1.1.0 HEAD~1000"])
+
+    # Linear history never needs the bit sets that we use for merges.
+    calls = []
+    original = history._get_ancestor_bits
+    monkeypatch.setattr(history, "_get_ancestor_bits", lambda *args: calls.append(args) or original(*args))
+
+    entries = list(history._get_version_history(config, tmp_path))
+    assert len(entries) == 5001
+    assert (entries[-1]["tag"], entries[-1]["distance"]) == ("v1.1.0", 1000)
+    assert calls == []
+
+
+def test__refresh_version_cache__incremental(tmp_path, monkeypatch, config):
+    from poetry_dynamic_versioning import cache
+
+    monkeypatch.setenv(plugin._CACHE_DIR_ENV, str(tmp_path / "cache"))
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "foo.txt").write_text("foo")
+    init_git_repo(repo, "v1.2.3")
+    assert cache._refresh_version_cache(config, repo).distance == 0
+
+    run_git_commands(repo, ["git commit -q --allow-empty -m a", "git commit -q --allow-empty -m b"])
+    with monkeypatch.context() as m:
+        # Only the new commits should be inspected.
+        m.setattr(cache, "_get_version_from_dunamai", None)
+        version = cache._refresh_version_cache(config, repo)
+    assert (version.base, version.distance) == ("1.2.3", 2)
+
+    expected = Version.from_git(path=repo)
+    assert version.commit == expected.commit
+    assert version.timestamp == expected.timestamp
+    assert version.branch == expected.branch
+    assert cache._get_version_from_cache(config, False, repo).distance == 2
+
+    run_git_commands(repo, ["git tag v1.3.0"])
+    assert cache._get_version_from_cache(config, False, repo) is None
+    assert cache._refresh_version_cache(config, repo).base == "1.3.0"
+
+
+def test__refresh_version_cache__tag_branch(tmp_path, monkeypatch, config):
+    from poetry_dynamic_versioning import cache
+    from dunamai import Pattern, Vcs
+
+    monkeypatch.setenv(plugin._CACHE_DIR_ENV, str(tmp_path / "cache"))
+    (tmp_path / "foo.txt").write_text("foo")
+    init_git_repo(tmp_path, "v1.0.0")
+    run_git_commands(
+        tmp_path,
+        [
+            "git branch -m main",
+            "git checkout -q -b release",
+            "git commit -q --allow-empty -m a",
+            "git tag v1.1.0",
+            "git checkout -q main",
+            "git checkout -q -b feature",
+            "git commit -q --allow-empty -m b",
+        ],
+    )
+    config["tag-branch"] = "main"
+    assert cache._refresh_version_cache(config, tmp_path).base == "1.0.0"
+
+    # The release tag only counts once it's merged into the tag branch, even though HEAD stays the same.
+    run_git_commands(tmp_path, ["git checkout -q main", "git merge -q --no-edit release", "git checkout -q feature"])
+    version = cache._refresh_version_cache(config, tmp_path)
+    expected = plugin._get_version_from_dunamai(
+        Vcs.Git, Pattern.Default, config, cache=False, server=False, path=tmp_path
+    )
+    assert (version.base, version.distance) == (expected.base, expected.distance) == ("1.1.0", 1)
+
+
+def test_install_hooks__foreign_hook(tmp_path, monkeypatch):
+    import shutil
+
+    (tmp_path / "pyproject.toml").write_text('[tool.poetry]\nname = "foo"\nversion = "0.0.0"\n')
+    init_git_repo(tmp_path, "v1.2.3")
+    hooks = tmp_path / ".git" / "hooks"
+    hooks.mkdir(exist_ok=True)
+    (hooks / "post-merge").write_text("#!/bin/sh\necho custom\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(shutil, "which", lambda name: "/usr/bin/poetry-dynamic-versioning")
+
+    with pytest.raises(RuntimeError):
+        cli.install_hooks()
+
+    # Nothing is installed unless every hook can be.
+    for hook in cli._HOOKS:
+        if hook != "post-merge":
+            assert not (hooks / hook).exists()
+    assert (hooks / "post-merge").read_text() == "#!/bin/sh\necho custom\n"
+
+
+def test_watch__pep621(tmp_path, monkeypatch, capsys):
+    import time
+
+    (tmp_path / "pyproject.toml").write_text(
+        '[project]\nname = "foo"\ndynamic = ["version"]\n\n[tool.poetry]\nversion = "0.0.0"\n\n'
+        "[tool.poetry-dynamic-versioning]\nenable = true\n"
+    )
+    init_git_repo(tmp_path, "v1.2.3")
+    monkeypatch.chdir(tmp_path)
+
+    rounds = []
+
+    def sleep(seconds: float) -> None:
+        rounds.append(seconds)
+        if len(rounds) == 1:
+            run_git_commands(tmp_path, ["git commit -q --allow-empty -m a"])
+        else:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(time, "sleep", sleep)
+    cli.watch(interval=0)
+
+    err = capsys.readouterr().err
+    assert "Error" not in err
+    assert "Version: 1.2.3\n" in err
+    assert "Version: 1.2.3.post1.dev0+" in err
+    pyproject = tomlkit.parse((tmp_path / "pyproject.toml").read_text())
+    assert pyproject["project"]["version"].startswith("1.2.3.post1.dev0+")
+
+
+def test__render_version_shim(tmp_path, monkeypatch, config):
+    monkeypatch.setenv(plugin._CACHE_DIR_ENV, str(tmp_path / "cache"))
+    repo = tmp_path / "repo"
+    (repo / "pkg").mkdir(parents=True)
+    (repo / "pyproject.toml").write_text("")
+    init_git_repo(repo, "v1.2.3")
+    module = repo / "pkg" / "_version.py"
+    module.write_text(plugin._render_version_shim("1.2.3", Version("1.2.3"), repo, module))
+    # The module also goes into built artifacts.
+    assert str(tmp_path) not in module.read_text()
+
+    def load(file: Path) -> dict:
+        namespace = {"__file__": str(file)}
+        exec(module.read_text(), namespace)
+        return namespace
+
+    assert load(module)["__version__"] == "1.2.3"
+
+    # Without a cached version for the new commit or a way to make one, the module keeps its values.
+    run_git_commands(repo, ["git commit -q --allow-empty -m a"])
+    original_path = os.environ["PATH"]
+    (tmp_path / "empty").mkdir()
+    monkeypatch.setenv("PATH", str(tmp_path / "empty"))
+    assert load(module)["__version__"] == "1.2.3"
+
+    # Otherwise, the module caches the version for the new commit without being regenerated.
+    script = tmp_path / "bin" / "poetry-dynamic-versioning"
+    script.parent.mkdir()
+    script.write_text(
+        '#!/bin/sh\nexec {} -c "from poetry_dynamic_versioning.__main__ import main; main()" "$@"\n'.format(
+            sys.executable
+        )
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", os.pathsep.join([str(script.parent), original_path]))
+    namespace = load(module)
+    expected = plugin._get_version(config, path=repo)[0]
+    assert namespace["__version__"] == expected
+    assert namespace["__version_tuple__"][:4] == (1, 2, 3, "post1")
+    assert namespace["__distance__"] == 1
+
+    # The cached version is reused from then on.
+    monkeypatch.setenv("PATH", str(tmp_path / "empty"))
+    assert load(module)["__version__"] == expected
+
+    # A regular installation keeps the version that it was built with.
+    (tmp_path / "site-packages" / "pkg").mkdir(parents=True)
+    assert load(tmp_path / "site-packages" / "pkg" / "_version.py")["__version__"] == "1.2.3"
+
+
+def test__render_version_shim__without_git(tmp_path):
+    content = plugin._render_version_shim("1.2.3", Version("1.2.3"), tmp_path, tmp_path / "_version.py")
+    assert content == plugin._render_version_module("1.2.3", Version("1.2.3"))
+
+
+def test__get_version__max_tag_search_depth(tmp_path, monkeypatch, config):
+    monkeypatch.setenv(plugin._CACHE_DIR_ENV, str(tmp_path / "cache"))
+    (tmp_path / "foo.txt").write_text("foo")
+    init_git_repo(tmp_path, "v1.2.3")
+    run_git_commands(tmp_path, ["git commit -q --allow-empty -m {}".format(i) for i in range(5)])
+    config["max-tag-search-depth"] = 3
+    config["fallback-base"] = "9.0.0"
+
+    version = plugin._get_version(config, path=tmp_path)[1]
+    assert (version.base, version.distance) == ("9.0.0", 2)
+    assert version.commit == Version.from_git(path=tmp_path).commit
+
+    # The distance is counted from the same anchor as more commits are added.
+    run_git_commands(tmp_path, ["git commit -q --allow-empty -m a", "git commit -q --allow-empty -m b"])
+    version = plugin._get_version(config, path=tmp_path)[1]
+    assert (version.base, version.distance) == ("9.0.0", 4)
+
+    config["strict"] = True
+    with pytest.raises(RuntimeError):
+        plugin._get_version(config, path=tmp_path)
+
+    config["max-tag-search-depth"] = 8
+    version = plugin._get_version(config, path=tmp_path)[1]
+    assert (version.base, version.distance) == ("1.2.3", 7)
+
+
+def test__get_version__deepen_shallow_repository(tmp_path, monkeypatch, capfd, config):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "foo.txt").write_text("foo")
+    init_git_repo(source, "v1.0.0")
+    run_git_commands(
+        source,
+        [
+            *["git commit -q --allow-empty -m {}".format(i) for i in range(100)],
+            "git tag v1.1.0",
+            "git checkout -q -b side",
+            *["git commit -q --allow-empty -m side{}".format(i) for i in range(30)],
+            "git checkout -q -",
+            *["git commit -q --allow-empty -m {}".format(i) for i in range(50)],
+            "git merge -q --no-edit side",
+            "git clone -q --bare . ../remote.git",
+            "git clone -q --depth 1 file://{} ../clone".format((tmp_path / "remote.git").as_posix()),
+        ],
+    )
+    clone = tmp_path / "clone"
+
+    commands = []
+    original_run_cmd = plugin._run_cmd
+
+    def run_cmd(command, *args, **kwargs):
+        commands.append(command)
+        return original_run_cmd(command, *args, **kwargs)
+
+    monkeypatch.setattr(plugin, "_run_cmd", run_cmd)
+    monkeypatch.delenv(plugin._DEBUG_ENV, raising=False)
+
+    config["fix-shallow-repository"] = True
+    assert plugin._get_version(config, path=clone)[1].distance == 81
+    # After the first check, only the newly fetched commits are listed.
+    listings = [x for x in commands if x.startswith("git rev-list ") and "--count" not in x and ".." not in x]
+    assert listings[0] == "git rev-list HEAD"
+    assert len(listings) > 1
+    assert "HEAD" not in " ".join(listings[1:])
+    # The summary is only for debugging.
+    assert "Deepened" not in capfd.readouterr().err
+
+    assert plugin._get_version(config, path=clone)[0] == plugin._get_version(config, path=source)[0]
+    assert (clone / ".git" / "shallow").exists()
+
+
+def test__should_apply_with_io(monkeypatch):
+    from poetry_dynamic_versioning.plugin import _COMMAND_NO_IO_ENV, _should_apply_with_io
+
+    monkeypatch.delenv(_COMMAND_NO_IO_ENV, raising=False)
+    assert _should_apply_with_io("build")
+    assert not _should_apply_with_io("lock")
+    # Path dependencies still get built.
+    assert _should_apply_with_io("install")
+
+    monkeypatch.setenv(_COMMAND_NO_IO_ENV, "build")
+    assert not _should_apply_with_io("build")
+    assert _should_apply_with_io("lock")
+
+
+def test__get_project_directory(tmp_path):
+    from types import SimpleNamespace
+
+    from poetry_dynamic_versioning.plugin import _get_project_directory
+
+    class Input:
+        def __init__(self, options):
+            self.options = options
+
+        def option(self, name):
+            return self.options[name]
+
+    # Poetry 2.0.0+
+    assert _get_project_directory(SimpleNamespace(project_directory=str(tmp_path))) == tmp_path
+
+    # Poetry 1.x
+    io = SimpleNamespace(input=Input({"directory": str(tmp_path)}))
+    assert _get_project_directory(SimpleNamespace(_io=io)) == tmp_path
+    io = SimpleNamespace(input=Input({"directory": None}))
+    assert _get_project_directory(SimpleNamespace(_io=io)) == Path.cwd()
+    io = SimpleNamespace(input=Input({}))
+    assert _get_project_directory(SimpleNamespace(_io=io)) == Path.cwd()
+    assert _get_project_directory(SimpleNamespace()) == Path.cwd()
+
+
+def test__detect_vcs_from_markers(tmp_path):
+    from dunamai import Vcs
+
+    nested = tmp_path / "a" / "b"
+    nested.mkdir(parents=True)
+    (tmp_path / ".git").mkdir()
+    (tmp_path / "a" / ".hg").mkdir()
+    assert plugin._detect_vcs_from_markers(nested) == Vcs.Mercurial
+    assert plugin._detect_vcs_from_markers(tmp_path) == Vcs.Git
+
+    archive = tmp_path / "archive"
+    archive.mkdir()
+    (archive / ".git_archival.json").write_text('{"hash-full": "abc"}')
+    assert plugin._detect_vcs_from_markers(archive) is None
+
+
+def test__detect_vcs_from_markers__new_repository(tmp_path):
+    from dunamai import Vcs
+
+    # Long-running processes notice when the repository is created, moved, or removed.
+    nested = tmp_path / "a" / "b"
+    nested.mkdir(parents=True)
+    (tmp_path / ".hg").mkdir()
+    assert plugin._detect_vcs_from_markers(nested) == Vcs.Mercurial
+
+    (tmp_path / "a" / ".git").mkdir()
+    assert plugin._detect_vcs_from_markers(nested) == Vcs.Git
+
+    (tmp_path / "a" / ".git").rename(nested / ".git")
+    assert plugin._detect_vcs_from_markers(nested) == Vcs.Git
+
+    (nested / ".git").rmdir()
+    assert plugin._detect_vcs_from_markers(nested) == Vcs.Mercurial
+
+
+def test__get_vcs_env():
+    env = plugin._get_vcs_env({"PATH": "/bin", "GIT_TRACE": "1", "GIT_DIR": ".git", "LC_ALL": "de_DE.UTF-8"})
+    assert env == {"PATH": "/bin", "GIT_DIR": ".git", "LC_ALL": "C", "GIT_OPTIONAL_LOCKS": "0"}
+
+
+def test__save_resolutions__applied(tmp_path, monkeypatch):
+    monkeypatch.setattr(plugin, "_state", plugin._State())
+    pyproject = tmp_path / "pyproject.toml"
+    source = tmp_path / "__init__.py"
+    state = plugin._ProjectState(
+        pyproject,
+        "0.0.0",
+        "1.2.3",
+        plugin._Mode.Pep621,
+        ["version"],
+        {source: '__version__ = "0.0.0"\n'},
+        instance=Version("1.2.3"),
+    )
+    state.substitution_folders[source] = 0
+    plugin._state.projects["foo"] = state
+
+    file = tmp_path / plugin._APPLIED_FILE
+    plugin._save_resolutions(file, applied=True)
+    plugin._state.projects.clear()
+    plugin._load_resolutions(file, applied=True)
+
+    restored = plugin._state.projects["foo"]
+    assert restored.path == pyproject
+    assert restored.original_version == "0.0.0"
+    assert restored.version == "1.2.3"
+    assert restored.mode == plugin._Mode.Pep621
+    assert restored.dynamic_array == ["version"]
+    assert restored.substitutions == {source: '__version__ = "0.0.0"\n'}
+    assert restored.substitution_folders == {source: 0}
+    assert restored.instance == Version("1.2.3")
+    assert plugin._state.resolutions[str(pyproject.resolve())]["version"] == "1.2.3"
+
+
+@pytest.mark.parametrize("module", ["poetry_dynamic_versioning.cli", "poetry_dynamic_versioning.plugin"])
+def test__import_time__lazy_dependencies(module):
+    if module.endswith(".plugin"):
+        pytest.importorskip("poetry.plugins")
+
+    # Installed packages come with compiled bytecode, so we don't count the time to compile our modules.
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    for _ in range(2):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=str(root),
+            env=env,
+        )
+        assert result.returncode == 0
+
+    # Lines look like `import time:       self [us] |  cumulative | imported package`.
+    timings = {}
+    own_time = 0
+    for line in result.stderr.decode("utf-8").splitlines():
+        parts = line.replace("import time:", "").split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            timings[parts[2].strip()] = int(parts[1])
+            if parts[2].strip().startswith("poetry_dynamic_versioning"):
+                own_time += int(parts[0])
+
+    # Make sure the output was parsed, or the checks below would pass trivially.
+    assert module in timings
+
+    for heavy in ["dunamai", "jinja2", "tomlkit"]:
+        assert heavy not in timings
+
+    # Our own modules took about 5 ms in total when this was added.
+    # The budget leaves plenty of room for slower machines, but not for eager imports or work at import time.
+    assert own_time < 50000